@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""Approximate nearest-neighbour search (IVF with spherical k-means centroids).
+
+Vectors are L2-normalized, so similarity is the dot product. At build time the
+rows are clustered into `n_lists` coarse centroids and each row is filed in the
+inverted list of its closest centroid. A query scores the centroids, scans
+only the rows in its `n_probe` best lists and returns the exact top-k among
+those candidates. `n_probe == n_lists` is exact search.
+
+The index stores row numbers, not vectors: it is used together with the
+matrix it was built from (doc_vectors) and is saved next to it as
+`<name>_ann_ivf.npz`.
+
+Recall/latency report against exact search:
+  python3 ann_index.py --vectors ../output/search_index_bge_m3/doc_vectors.npy --k 10 --probes 1,2,4,8
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+DEFAULT_ITER = 20
+DEFAULT_PROBE = 4
+
+
+def default_n_lists(n: int) -> int:
+    return max(1, int(round(np.sqrt(n))))
+
+
+def index_path(search_dir: str, name: str) -> str:
+    return os.path.join(search_dir, f"{name}_ann_ivf.npz")
+
+
+def _normalize_rows(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+class IVFIndex:
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, ids: np.ndarray, n_probe: int = DEFAULT_PROBE):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.offsets = offsets.astype(np.int64)
+        self.ids = ids.astype(np.int64)
+        self.n_probe = n_probe
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def size(self) -> int:
+        return int(self.ids.shape[0])
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        n_lists: int = 0,
+        n_iter: int = DEFAULT_ITER,
+        n_probe: int = DEFAULT_PROBE,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        data = np.asarray(vectors, dtype=np.float32)
+        n = data.shape[0]
+        if n == 0:
+            return cls(np.zeros((0, data.shape[1] if data.ndim == 2 else 0)), np.zeros(1), np.zeros(0), n_probe)
+        n_lists = min(n, n_lists or default_n_lists(n))
+        rng = np.random.default_rng(seed)
+        centroids = data[rng.choice(n, size=n_lists, replace=False)].copy()
+        assign = np.zeros(n, dtype=np.int64)
+        for _ in range(max(1, n_iter)):
+            assign = np.argmax(data @ centroids.T, axis=1)
+            counts = np.bincount(assign, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, data)
+            empty = counts == 0
+            if empty.any():
+                # re-seed empty lists with random rows
+                sums[empty] = data[rng.choice(n, size=int(empty.sum()), replace=False)]
+            centroids = _normalize_rows(sums).astype(np.float32)
+        assign = np.argmax(data @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=n_lists))
+        return cls(centroids, offsets, order, min(n_probe, n_lists))
+
+    def candidates(self, qvec: np.ndarray, n_probe: int | None = None) -> np.ndarray:
+        probe = min(self.n_lists, n_probe or self.n_probe)
+        lists = _top_k(self.centroids @ qvec, probe)
+        return np.concatenate([self.ids[self.offsets[i] : self.offsets[i + 1]] for i in lists])
+
+    def search(
+        self, matrix: np.ndarray, qvec: np.ndarray, k: int, n_probe: int | None = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Row numbers and scores of the (approximate) top-k rows of matrix, best first."""
+        cand = self.candidates(qvec, n_probe)
+        if cand.size == 0:
+            return cand, np.zeros(0, dtype=np.float32)
+        scores = matrix[cand] @ qvec
+        best = _top_k(scores, k)
+        return cand[best], scores[best]
+
+    def save(self, path: str) -> None:
+        np.savez(path, centroids=self.centroids, offsets=self.offsets, ids=self.ids, n_probe=np.int64(self.n_probe))
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(data["centroids"], data["offsets"], data["ids"], int(data["n_probe"]))
+
+
+def load_for(path: str, matrix: np.ndarray) -> IVFIndex | None:
+    """Load an index if it exists and was built from a matrix of this shape."""
+    if not os.path.exists(path):
+        return None
+    index = IVFIndex.load(path)
+    if index.size != matrix.shape[0] or (index.n_lists and index.centroids.shape[1] != matrix.shape[1]):
+        print(f"Ignoring stale ANN index {path} ({index.size} rows, matrix has {matrix.shape[0]})")
+        return None
+    return index
+
+
+def build_and_save(path: str, vectors: np.ndarray, n_lists: int = 0, n_iter: int = DEFAULT_ITER) -> Dict:
+    index = IVFIndex.build(vectors, n_lists=n_lists, n_iter=n_iter)
+    index.save(path)
+    return {"file": os.path.basename(path), "n_lists": index.n_lists, "n_probe": index.n_probe, "rows": index.size}
+
+
+def recall_report(
+    matrix: np.ndarray, index: IVFIndex, k: int, probes: Iterable[int], n_queries: int, noise: float, seed: int
+) -> List[Dict]:
+    """recall@k and mean latency of IVF vs. exact search for perturbed copies of random rows."""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(matrix.shape[0], size=min(n_queries, matrix.shape[0]), replace=False)
+    queries = matrix[rows] + rng.standard_normal((rows.shape[0], matrix.shape[1])).astype(np.float32) * noise
+    queries = _normalize_rows(queries).astype(np.float32)
+
+    t0 = time.perf_counter()
+    exact = [set(_top_k(matrix @ q, k).tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+    report = []
+    for probe in probes:
+        probe = min(probe, index.n_lists)
+        hits = 0
+        scanned = 0
+        t0 = time.perf_counter()
+        for q, truth in zip(queries, exact):
+            ids, _ = index.search(matrix, q, k, probe)
+            hits += len(truth.intersection(ids.tolist()))
+        ann_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+        for q in queries:
+            scanned += index.candidates(q, probe).shape[0]
+        report.append(
+            {
+                "n_probe": probe,
+                "recall_at_k": round(hits / (k * len(queries)), 4),
+                "ann_ms": round(ann_ms, 4),
+                "exact_ms": round(exact_ms, 4),
+                "scanned_frac": round(scanned / (len(queries) * matrix.shape[0]), 4),
+            }
+        )
+    return report
+
+
+def load_vectors(path: str) -> np.ndarray:
+    if path.endswith(".npy"):
+        return np.ascontiguousarray(np.load(path), dtype=np.float32)
+    vecs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                vec = json.loads(line).get("vector") or []
+                if vec:
+                    vecs.append(vec)
+    return np.asarray(vecs, dtype=np.float32)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", required=True, help="a .npy matrix (doc_vectors.npy, paragraph_embeddings.npy) or doc_embeddings.jsonl")
+    parser.add_argument("--index", help="saved IVF index (default: build one in memory)")
+    parser.add_argument("--lists", type=int, default=0, help="n_lists when building in memory (0 = sqrt(rows))")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--probes", default="1,2,4,8,16")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    matrix = load_vectors(args.vectors)
+    if args.index:
+        index = load_for(args.index, matrix)
+        if index is None:
+            raise SystemExit(f"Index {args.index} is missing or does not match {args.vectors}")
+    else:
+        index = IVFIndex.build(matrix, n_lists=args.lists)
+
+    probes = [int(p) for p in args.probes.split(",") if p.strip()]
+    print(f"rows={matrix.shape[0]} dim={matrix.shape[1]} lists={index.n_lists} k={args.k}")
+    print(f"{'probe':>6} {'recall@k':>9} {'ann ms':>9} {'exact ms':>9} {'scanned':>8}")
+    for r in recall_report(matrix, index, args.k, probes, args.queries, args.noise, args.seed):
+        print(
+            f"{r['n_probe']:>6} {r['recall_at_k']:>9.4f} {r['ann_ms']:>9.4f} "
+            f"{r['exact_ms']:>9.4f} {r['scanned_frac']:>8.2%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Micro-benchmark: pure-Python doc scoring vs. NumPy matrix-vector scoring.
+
+Compares the old `search_server.search()` loop (dot() per row + full sort)
+with the vectorized path (one float32 mat-vec + argpartition top-k).
+
+Example:
+  python3 bench_search_scoring.py --sizes 44,1000,10000 --top 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from vector_store import has_doc_vectors, load_doc_vectors
+
+OUTPUT_DIR = "/Users/TH_1/Documents/Repo/ACO/data_processing/output"
+EMB_DIR = os.path.join(OUTPUT_DIR, "search_index_bge_m3")
+
+
+def dot(a: List[float], b: List[float]) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+
+def score_loop(rows: List[Dict], qvec: List[float], top: int) -> List[Tuple[str, float]]:
+    scored = []
+    for row in rows:
+        scored.append((row["doc_id"], dot(qvec, row["vector"])))
+    scored.sort(key=lambda x: x[1], reverse=True)
+    return scored[:top]
+
+
+def score_matrix(doc_ids: List[str], matrix: np.ndarray, qvec: np.ndarray, top: int) -> List[Tuple[str, float]]:
+    scores = matrix @ qvec
+    k = min(top, scores.shape[0])
+    part = np.argpartition(-scores, k - 1)[:k]
+    order = part[np.argsort(-scores[part], kind="stable")]
+    return [(doc_ids[i], float(scores[i])) for i in order]
+
+
+def base_vectors(index_dir: str, dim: int, rng: np.random.Generator) -> np.ndarray:
+    if has_doc_vectors(index_dir):
+        _, vecs = load_doc_vectors(index_dir)
+        if vecs.shape[0]:
+            return np.asarray(vecs, dtype=np.float32)
+    return rng.standard_normal((44, dim)).astype(np.float32)
+
+
+def make_corpus(base: np.ndarray, size: int, rng: np.random.Generator) -> np.ndarray:
+    # tile the real vectors and jitter them so larger corpora stay realistic
+    reps = -(-size // base.shape[0])
+    mat = np.tile(base, (reps, 1))[:size]
+    mat = mat + rng.standard_normal(mat.shape).astype(np.float32) * 0.01
+    mat /= np.linalg.norm(mat, axis=1, keepdims=True)
+    return np.ascontiguousarray(mat, dtype=np.float32)
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index-dir", default=EMB_DIR, help="index whose doc vectors seed the synthetic corpora")
+    parser.add_argument("--sizes", default="44,1000,10000")
+    parser.add_argument("--dim", type=int, default=1024, help="only used if --index-dir has no doc vectors")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    base = base_vectors(args.index_dir, args.dim, rng)
+    dim = base.shape[1]
+
+    print(f"dim={dim} top={args.top} repeat={args.repeat} (best of)")
+    print(f"{'docs':>8} {'loop ms':>10} {'numpy ms':>10} {'speedup':>8}  same top-k")
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        matrix = make_corpus(base, size, rng)
+        doc_ids = [f"doc{i}" for i in range(size)]
+        rows = [{"doc_id": d, "vector": v} for d, v in zip(doc_ids, matrix.tolist())]
+        q = matrix[rng.integers(size)] + rng.standard_normal(dim).astype(np.float32) * 0.05
+        q /= np.linalg.norm(q)
+        q_list = q.tolist()
+
+        t_loop = timed(lambda: score_loop(rows, q_list, args.top), args.repeat)
+        t_np = timed(lambda: score_matrix(doc_ids, matrix, q, args.top), args.repeat)
+        same = [d for d, _ in score_loop(rows, q_list, args.top)] == [
+            d for d, _ in score_matrix(doc_ids, matrix, q, args.top)
+        ]
+        print(f"{size:>8} {t_loop * 1000:>10.3f} {t_np * 1000:>10.3f} {t_loop / t_np:>7.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    main()
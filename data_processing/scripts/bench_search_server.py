@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Load test for a running search_server.py: throughput and latency under N concurrent clients.
+
+Start the server first (single-threaded or with --concurrent), then e.g.:
+  python3 bench_search_server.py --url http://localhost:8000 --clients 1,4,16 --requests 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import threading
+import time
+from typing import Dict, List
+from urllib.parse import quote
+from urllib.request import urlopen
+
+QUERIES = [
+    "Theotokos",
+    "Nestorius",
+    "Kyrill von Alexandrien",
+    "Konzil von Ephesus",
+    "Johannes von Antiochien",
+    "Absetzung des Nestorius",
+    "Brief an den Kaiser",
+    "Menschwerdung des Logos",
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def run_clients(url: str, clients: int, requests: int, top: int, unique: bool) -> Dict:
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def client(cid: int) -> None:
+        nonlocal errors
+        for i in range(requests):
+            q = QUERIES[(cid + i) % len(QUERIES)]
+            if unique:
+                # defeat any query cache so every request hits the model
+                q = f"{q} {cid}-{i}-{time.monotonic_ns()}"
+            t0 = time.perf_counter()
+            try:
+                with urlopen(f"{url}/api/search?q={quote(q)}&top={top}", timeout=300) as res:
+                    json.loads(res.read())
+            except Exception:
+                with lock:
+                    errors += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": errors,
+        "wall_s": wall,
+        "throughput_rps": len(latencies) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--clients", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--unique", action="store_true", help="make every query text distinct")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+
+    if not args.json:
+        print(f"{'clients':>7} {'reqs':>6} {'err':>4} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for n in [int(c) for c in args.clients.split(",") if c.strip()]:
+        r = run_clients(args.url.rstrip("/"), n, args.requests, args.top, args.unique)
+        if args.json:
+            print(json.dumps(r))
+            continue
+        print(
+            f"{r['clients']:>7} {r['requests']:>6} {r['errors']:>4} {r['throughput_rps']:>8.2f} "
+            f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Opt-in reduced-precision CPU inference for BGE-M3, plus a drift/speed report.
+
+Modes:
+  - none: full fp32 model (default)
+  - int8: dynamic int8 quantization of all nn.Linear layers (CPU only)
+  - bf16: weights and activations in bfloat16
+
+Used by build_search_index_bge_m3.py (--quantize) and search_server.py (--quantize).
+
+Report (cosine drift of the index's own chunks, re-embedded with the quantized
+model, vs. their fp32 chunk_vectors and doc vectors, and fp32 vs. quantized
+time per batch size). The chunk texts are cut from the corpus with the spans in
+chunk_index.jsonl, so the drift is quantization error only:
+  python3 bge_m3_quantization.py --model-path /path/to/bge-m3 --mode int8 --batch-sizes 1,8,32
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+
+QUANTIZATION_MODES = ("none", "int8", "bf16")
+
+
+def quantize_model(model, mode: str):
+    """Return model converted for `mode`; call after model.eval()."""
+    import torch
+
+    if mode == "none":
+        return model
+    if mode == "int8":
+        from torch.ao.quantization import quantize_dynamic
+
+        return quantize_dynamic(model.to("cpu"), {torch.nn.Linear}, dtype=torch.qint8)
+    if mode == "bf16":
+        return model.to(dtype=torch.bfloat16)
+    raise ValueError(f"Unknown quantization mode '{mode}' (expected one of {', '.join(QUANTIZATION_MODES)})")
+
+
+def model_device(mode: str, device: str) -> str:
+    # dynamic int8 kernels exist for CPU only
+    return "cpu" if mode == "int8" else device
+
+
+def cosine_drift(reference: np.ndarray, other: np.ndarray) -> Dict[str, float]:
+    ref = reference / np.linalg.norm(reference, axis=1, keepdims=True).clip(min=1e-12)
+    oth = other / np.linalg.norm(other, axis=1, keepdims=True).clip(min=1e-12)
+    cos = np.sum(ref * oth, axis=1)
+    return {
+        "n": int(cos.shape[0]),
+        "mean_cos": float(cos.mean()),
+        "min_cos": float(cos.min()),
+        "p05_cos": float(np.percentile(cos, 5)),
+        "max_drift": float(1.0 - cos.min()),
+    }
+
+
+def time_batches(texts: List[str], tokenizer, model, batch_size: int, repeat: int) -> float:
+    """Best-of-repeat seconds per batch for the first batch_size texts."""
+    from build_search_index_bge_m3 import encode
+
+    batch = (texts * batch_size)[:batch_size]
+    encode(batch, tokenizer, model, "cpu", batch_size)  # warm-up
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        encode(batch, tokenizer, model, "cpu", batch_size)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    from build_search_index_bge_m3 import (
+        CORPUS_PATH,
+        SEARCH_DIR,
+        encode,
+        normalize_space,
+        read_jsonl,
+        resolve_model_path,
+        text_sha256,
+    )
+    from multi_vector import CHUNK_INDEX, CHUNK_VECTORS
+    from multi_vector import exists as chunk_index_exists
+    from vector_store import load as load_vectors
+    from vector_store import load_doc_vectors
+
+    try:
+        from transformers import AutoTokenizer, AutoModel
+        import torch
+    except Exception as exc:
+        raise SystemExit(
+            "Missing dependencies. Install 'torch' and 'transformers' to use BGE-M3."
+        ) from exc
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-path", default="BAAI/bge-m3")
+    parser.add_argument("--index-dir", default=SEARCH_DIR, help="index holding the fp32 chunk and doc vectors")
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--mode", choices=QUANTIZATION_MODES[1:], default="int8")
+    parser.add_argument("--batch-size", type=int, default=8, help="batch size for re-embedding docs")
+    parser.add_argument("--batch-sizes", default="1,8,32", help="batch sizes for the speed comparison")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--limit", type=int, default=0, help="only re-embed the first N docs (0 = all)")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    resolved = resolve_model_path(args.model_path)
+    tokenizer = AutoTokenizer.from_pretrained(resolved, use_fast=False)
+    fp32 = AutoModel.from_pretrained(resolved).to("cpu")
+    fp32.eval()
+    quant = quantize_model(AutoModel.from_pretrained(resolved).to("cpu").eval(), args.mode)
+
+    if not chunk_index_exists(args.index_dir):
+        raise SystemExit(f"No chunk vectors in {args.index_dir}; rebuild it with build_search_index_bge_m3.py")
+    with open(os.path.join(args.index_dir, "index_meta.json"), "r", encoding="utf-8") as f:
+        built_with = json.load(f).get("embedding", {}).get("quantization", "none")
+    if built_with != "none":
+        print(f"warning: {args.index_dir} was built with --quantize {built_with}; the reference is not fp32")
+    ref_ids, ref_matrix = load_doc_vectors(args.index_dir)
+    reference = dict(zip(ref_ids, ref_matrix))
+    chunk_hashes, chunk_matrix, _ = load_vectors(args.index_dir, CHUNK_VECTORS)
+    chunk_rows = {row["doc_id"]: row for row in read_jsonl(os.path.join(args.index_dir, CHUNK_INDEX))}
+
+    doc_ids: List[str] = []
+    ref_vecs: List[np.ndarray] = []
+    quant_vecs: List[np.ndarray] = []
+    ref_chunks: List[np.ndarray] = []
+    quant_chunks: List[np.ndarray] = []
+    sample_texts: List[str] = []
+    stale = 0
+    for row in read_jsonl(args.corpus):
+        if args.limit and len(doc_ids) >= args.limit:
+            break
+        doc_id = row.get("doc_id")
+        entry = chunk_rows.get(doc_id)
+        if entry is None or doc_id not in reference:
+            continue
+        text = normalize_space(" ".join([row.get("text_main", ""), row.get("text_notes", "")]))
+        chunks = [text[a:b] for a, b in entry["spans"]]
+        rows = range(entry["start"], entry["start"] + entry["count"])
+        # the corpus changed since the build: these are not the texts behind the stored vectors
+        if [text_sha256(c) for c in chunks] != [chunk_hashes[i] for i in rows]:
+            stale += 1
+            continue
+        vecs = encode(chunks, tokenizer, quant, "cpu", args.batch_size).float()
+        emb = torch.nn.functional.normalize(vecs.mean(dim=0), p=2, dim=0)
+        doc_ids.append(doc_id)
+        ref_vecs.append(reference[doc_id])
+        quant_vecs.append(emb.numpy())
+        ref_chunks.extend(chunk_matrix[i] for i in rows)
+        quant_chunks.extend(vecs.numpy())
+        sample_texts.extend((row.get("paragraphs") or [])[:4])
+    if stale:
+        print(f"warning: skipped {stale} docs whose text changed since the index was built")
+
+    report: Dict = {"mode": args.mode, "model": resolved}
+    if doc_ids:
+        report["chunk_drift"] = cosine_drift(np.stack(ref_chunks), np.stack(quant_chunks))
+        report["doc_drift"] = cosine_drift(np.stack(ref_vecs), np.stack(quant_vecs))
+
+    speed = []
+    if sample_texts:
+        for bs in [int(b) for b in args.batch_sizes.split(",") if b.strip()]:
+            t_fp32 = time_batches(sample_texts, tokenizer, fp32, bs, args.repeat)
+            t_quant = time_batches(sample_texts, tokenizer, quant, bs, args.repeat)
+            speed.append(
+                {
+                    "batch_size": bs,
+                    "fp32_ms": round(t_fp32 * 1000, 2),
+                    f"{args.mode}_ms": round(t_quant * 1000, 2),
+                    "speedup": round(t_fp32 / t_quant, 2) if t_quant else None,
+                }
+            )
+    report["speed"] = speed
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for kind in ("chunk", "doc"):
+        drift = report.get(f"{kind}_drift")
+        if drift:
+            print(
+                f"{args.mode} vs fp32 {kind} vectors ({drift['n']} {kind}s): "
+                f"mean cos {drift['mean_cos']:.5f}, p05 {drift['p05_cos']:.5f}, min {drift['min_cos']:.5f}"
+            )
+    print(f"{'batch':>6} {'fp32 ms':>10} {args.mode + ' ms':>10} {'speedup':>8}")
+    for s in speed:
+        print(f"{s['batch_size']:>6} {s['fp32_ms']:>10.2f} {s[args.mode + '_ms']:>10.2f} {s['speedup']:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
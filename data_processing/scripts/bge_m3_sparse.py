@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""BGE-M3 sparse lexical weights and their inverted index.
+
+Besides the dense vector, BGE-M3 scores every input token with its sparse
+head (sparse_linear.pt in the model snapshot): relu(hidden_state @ w + b). A
+text's lexical weights are the max weight per token id, special tokens left
+out, and two texts match by the sum of weight products over their shared
+tokens. The weights come from the hidden states the dense vector is pooled
+from, so they cost no second forward pass.
+
+build_search_index_bge_m3.py writes, next to the dense vectors:
+
+  chunk_sparse.npz   ids (chunk text hashes), offsets (chunks + 1), token, weight
+                     (float16): per-chunk weights, reused by incremental builds
+  sparse_postings.npz  tokens (sorted token ids), offsets (tokens + 1),
+                     doc (uint32 doc row per posting), weight (float16)
+  sparse_meta.json   {"doc_ids": [...], "pooling": "max"}
+
+A doc's weight for a token is its max over the doc's chunks. Doc rows follow
+doc_vectors.npy, so sparse and dense scores of a query add up row by row.
+
+  python3 bge_m3_sparse.py --index-dir ../output/search_index_bge_m3
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+SPARSE_HEAD = "sparse_linear.pt"
+CHUNK_SPARSE = "chunk_sparse.npz"
+POSTINGS_NAME = "sparse_postings.npz"
+META_NAME = "sparse_meta.json"
+SPARSE_WEIGHT = 0.3  # weight of the sparse score in dense + sparse fusion
+
+# token id -> weight
+Weights = Dict[int, float]
+
+
+def load_sparse_head(model_dir: str, hidden_size: int):
+    """The sparse head as a torch Linear(hidden_size, 1), or None if the snapshot has none."""
+    import torch
+
+    path = os.path.join(model_dir, SPARSE_HEAD)
+    if not os.path.isfile(path):
+        return None
+    head = torch.nn.Linear(hidden_size, 1)
+    head.load_state_dict(torch.load(path, map_location="cpu", weights_only=True))
+    head.eval()
+    return head
+
+
+def token_weights(hidden, input_ids, attention_mask, head, skip_ids: Iterable[int]) -> List[Weights]:
+    """Lexical weights of every text in a batch, from its last hidden states."""
+    import torch
+
+    with torch.no_grad():
+        w = torch.relu(head(hidden.float())).squeeze(-1) * attention_mask
+    w = w.cpu().numpy()
+    ids = input_ids.cpu().numpy()
+    keep = (w > 0) & ~np.isin(ids, np.asarray(list(skip_ids), dtype=ids.dtype))
+    out: List[Weights] = []
+    for row_ids, row_w, row_keep in zip(ids, w, keep):
+        tok, val = row_ids[row_keep], row_w[row_keep]
+        # max per token id: sort by id, highest weight first, keep the first of each id
+        order = np.lexsort((-val, tok))
+        tok, val = tok[order], val[order]
+        first = np.ones(tok.shape[0], dtype=bool)
+        first[1:] = tok[1:] != tok[:-1]
+        out.append(dict(zip(tok[first].tolist(), val[first].tolist())))
+    return out
+
+
+def max_pool(weights: Iterable[Weights]) -> Weights:
+    """Per-token max over several texts (a doc's chunks)."""
+    pooled: Weights = {}
+    for w in weights:
+        for tok, val in w.items():
+            if val > pooled.get(tok, 0.0):
+                pooled[tok] = val
+    return pooled
+
+
+def save_chunk_weights(index_dir: str, ids: List[str], weights: List[Weights]) -> None:
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(w) for w in weights])
+    total = int(offsets[-1])
+    values = np.fromiter((v for w in weights for v in w.values()), dtype=np.float32, count=total)
+    np.savez(
+        os.path.join(index_dir, CHUNK_SPARSE),
+        ids=np.asarray(ids, dtype=str),
+        offsets=offsets,
+        token=np.fromiter((t for w in weights for t in w), dtype=np.int32, count=total),
+        weight=values.astype(np.float16),
+    )
+
+
+def load_chunk_weights(index_dir: str) -> Dict[str, Weights]:
+    """Chunk text hash -> weights, as written by save_chunk_weights()."""
+    path = os.path.join(index_dir, CHUNK_SPARSE)
+    if not os.path.exists(path):
+        return {}
+    with np.load(path) as data:
+        ids, offsets = data["ids"].tolist(), data["offsets"]
+        tokens, weights = data["token"].tolist(), data["weight"].astype(np.float32).tolist()
+    return {h: dict(zip(tokens[a:b], weights[a:b])) for h, a, b in zip(ids, offsets[:-1], offsets[1:])}
+
+
+class SparseIndex:
+    def __init__(self, doc_ids: List[str], tokens: np.ndarray, offsets: np.ndarray, docs: np.ndarray, weights: np.ndarray):
+        self.doc_ids = doc_ids
+        self.tokens = tokens.astype(np.int64)
+        self.offsets = offsets.astype(np.int64)
+        self.docs = docs.astype(np.int64)
+        self.weights = weights.astype(np.float32)
+
+    @classmethod
+    def build(cls, doc_ids: List[str], doc_weights: Sequence[Weights]) -> "SparseIndex":
+        counts = [len(w) for w in doc_weights]
+        total = sum(counts)
+        p_tok = np.fromiter((t for w in doc_weights for t in w), dtype=np.int64, count=total)
+        p_w = np.fromiter((v for w in doc_weights for v in w.values()), dtype=np.float32, count=total)
+        p_doc = np.repeat(np.arange(len(doc_ids), dtype=np.int64), counts)
+        # group postings by token (docs stay ascending)
+        order = np.lexsort((p_doc, p_tok))
+        tokens, per_token = np.unique(p_tok, return_counts=True)
+        offsets = np.zeros(tokens.shape[0] + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(per_token)
+        return cls(doc_ids, tokens, offsets, p_doc[order], p_w[order].astype(np.float16))
+
+    @property
+    def n_postings(self) -> int:
+        return int(self.docs.shape[0])
+
+    def save(self, index_dir: str) -> Dict:
+        np.savez(
+            os.path.join(index_dir, POSTINGS_NAME),
+            tokens=self.tokens.astype(np.int32),
+            offsets=self.offsets,
+            doc=self.docs.astype(np.uint32),
+            weight=self.weights.astype(np.float16),
+        )
+        with open(os.path.join(index_dir, META_NAME), "w", encoding="utf-8") as f:
+            json.dump({"doc_ids": self.doc_ids, "pooling": "max"}, f, ensure_ascii=False)
+        return {
+            "postings": POSTINGS_NAME,
+            "meta": META_NAME,
+            "chunk_weights": CHUNK_SPARSE,
+            "n_tokens": int(self.tokens.shape[0]),
+            "n_postings": self.n_postings,
+        }
+
+    @classmethod
+    def load(cls, index_dir: str) -> "SparseIndex":
+        with open(os.path.join(index_dir, META_NAME), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with np.load(os.path.join(index_dir, POSTINGS_NAME)) as data:
+            return cls(meta["doc_ids"], data["tokens"], data["offsets"], data["doc"], data["weight"])
+
+    def scores(self, query: Weights) -> np.ndarray:
+        """Lexical match score of every doc: sum over shared tokens of query weight x doc weight."""
+        if not query:
+            return np.zeros(len(self.doc_ids), dtype=np.float32)
+        q_tok = np.fromiter(query.keys(), dtype=np.int64, count=len(query))
+        q_w = np.fromiter(query.values(), dtype=np.float32, count=len(query))
+        rows = np.searchsorted(self.tokens, q_tok)
+        found = rows < self.tokens.shape[0]
+        found[found] = self.tokens[rows[found]] == q_tok[found]
+        rows, q_w = rows[found], q_w[found]
+        if rows.size == 0:
+            return np.zeros(len(self.doc_ids), dtype=np.float32)
+        starts, ends = self.offsets[rows], self.offsets[rows + 1]
+        lengths = ends - starts
+        # posting positions of all query tokens, and the query weight of each
+        idx = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+        weights = self.weights[idx] * np.repeat(q_w, lengths)
+        return np.bincount(self.docs[idx], weights=weights, minlength=len(self.doc_ids)).astype(np.float32)
+
+    def search(self, query: Weights, top: int) -> List[Tuple[str, float]]:
+        """Best docs with a positive score, best first."""
+        scores = self.scores(query)
+        hit = np.flatnonzero(scores > 0)
+        if hit.size == 0 or top <= 0:
+            return []
+        if hit.size > top:
+            hit = hit[np.argpartition(-scores[hit], top - 1)[:top]]
+        hit = hit[np.lexsort((hit, -scores[hit]))]
+        return [(self.doc_ids[i], float(scores[i])) for i in hit]
+
+
+def exists(index_dir: str) -> bool:
+    return os.path.exists(os.path.join(index_dir, POSTINGS_NAME)) and os.path.exists(
+        os.path.join(index_dir, META_NAME)
+    )
+
+
+def remove(index_dir: str) -> None:
+    """Drop sparse files of an earlier build; their doc rows no longer match the dense vectors."""
+    for name in (POSTINGS_NAME, META_NAME, CHUNK_SPARSE):
+        path = os.path.join(index_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index-dir", required=True, help="BGE-M3 index with sparse_postings.npz")
+    parser.add_argument("--queries", type=int, default=200, help="docs whose top tokens are used as queries")
+    parser.add_argument("--query-tokens", type=int, default=8, help="tokens per query")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    index = SparseIndex.load(args.index_dir)
+    load_ms = (time.perf_counter() - t0) * 1000
+    print(f"{len(index.doc_ids)} docs, {index.tokens.shape[0]} tokens, {index.n_postings} postings; load {load_ms:.1f} ms")
+    if not index.n_postings:
+        return
+    # a query of a doc's heaviest tokens should find that doc
+    rng = np.random.default_rng(0)
+    per_doc: Dict[int, List[Tuple[float, int]]] = {}
+    token_of = np.repeat(index.tokens, np.diff(index.offsets))
+    for doc, tok, w in zip(index.docs.tolist(), token_of.tolist(), index.weights.tolist()):
+        per_doc.setdefault(doc, []).append((w, tok))
+    docs = rng.choice(sorted(per_doc), size=args.queries)
+    queries = [dict((tok, w) for w, tok in sorted(per_doc[d], reverse=True)[: args.query_tokens]) for d in docs]
+    t0 = time.perf_counter()
+    found = sum(index.search(q, 10)[0][0] == index.doc_ids[d] for q, d in zip(queries, docs))
+    per_query = (time.perf_counter() - t0) * 1000 / len(queries)
+    print(f"  {per_query:.3f} ms/query; source doc ranked first for {found}/{len(queries)} queries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""BM25 over an inverted index of the corpus tokens, plus reciprocal-rank fusion.
+
+Built by build_search_index.py from the same tokens as the hash embeddings
+(tokenize(), len >= 2, no stopwords) and stored next to them:
+
+  bm25_postings.npz  offsets (terms + 1), doc (uint32 doc row per posting),
+                     tf (uint16/uint32), doc_len (tokens per doc)
+  bm25_terms.json    {"terms": [...sorted...], "doc_ids": [...], "k1", "b"}
+
+Postings of term i are doc[offsets[i]:offsets[i + 1]]. At load, every posting
+gets its BM25 weight (idf * saturated tf), so a query is a bincount over the
+postings of its terms.
+
+  python3 bm25_index.py --index-dir ../output/search_index "Basilius Caesarea"
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+K1 = 1.2
+B = 0.75
+RRF_K = 60  # rank constant of reciprocal-rank fusion
+RRF_DEPTH = 100  # hits taken from each ranking before fusing
+
+POSTINGS_NAME = "bm25_postings.npz"
+TERMS_NAME = "bm25_terms.json"
+
+
+def query_terms(text: str) -> List[str]:
+    """Query tokens, filtered exactly like the indexed doc tokens."""
+    from build_search_index import STOPWORDS, tokenize
+
+    return [t for t in tokenize(text) if len(t) >= 2 and t not in STOPWORDS]
+
+
+class BM25Index:
+    def __init__(
+        self,
+        terms: List[str],
+        doc_ids: List[str],
+        offsets: np.ndarray,
+        docs: np.ndarray,
+        tfs: np.ndarray,
+        doc_len: np.ndarray,
+        k1: float = K1,
+        b: float = B,
+    ):
+        self.terms = terms
+        self.term_row = {t: i for i, t in enumerate(terms)}
+        self.doc_ids = doc_ids
+        self.offsets = offsets.astype(np.int64)
+        self.docs = docs.astype(np.int64)
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        self.weights = self._posting_weights()
+
+    def _posting_weights(self) -> np.ndarray:
+        n_docs = len(self.doc_ids)
+        if self.docs.size == 0:
+            return np.zeros(0, dtype=np.float32)
+        df = np.diff(self.offsets).astype(np.float64)
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+        avgdl = float(self.doc_len.mean()) or 1.0
+        tf = self.tfs.astype(np.float64)
+        norm = self.k1 * (1.0 - self.b + self.b * self.doc_len[self.docs] / avgdl)
+        per_posting_idf = np.repeat(idf, np.diff(self.offsets))
+        return (per_posting_idf * tf * (self.k1 + 1.0) / (tf + norm)).astype(np.float32)
+
+    @classmethod
+    def build(cls, doc_tokens: Sequence[Tuple[str, List[str]]], k1: float = K1, b: float = B) -> "BM25Index":
+        doc_ids = [doc_id for doc_id, _ in doc_tokens]
+        term_ids: Dict[str, int] = {}
+        post_term: List[np.ndarray] = []
+        post_doc: List[np.ndarray] = []
+        post_tf: List[np.ndarray] = []
+        doc_len = np.zeros(len(doc_ids), dtype=np.int64)
+        for row, (_, tokens) in enumerate(doc_tokens):
+            doc_len[row] = len(tokens)
+            if not tokens:
+                continue
+            ids = np.asarray([term_ids.setdefault(t, len(term_ids)) for t in tokens], dtype=np.int64)
+            uniq, counts = np.unique(ids, return_counts=True)
+            post_term.append(uniq)
+            post_doc.append(np.full(uniq.shape[0], row, dtype=np.int64))
+            post_tf.append(counts)
+
+        # renumber terms alphabetically and group postings by term (docs stay ascending)
+        terms = sorted(term_ids)
+        rank = np.empty(len(term_ids), dtype=np.int64)
+        rank[[term_ids[t] for t in terms]] = np.arange(len(terms))
+        p_term = rank[np.concatenate(post_term)] if post_term else np.zeros(0, dtype=np.int64)
+        p_doc = np.concatenate(post_doc) if post_doc else np.zeros(0, dtype=np.int64)
+        p_tf = np.concatenate(post_tf) if post_tf else np.zeros(0, dtype=np.int64)
+        order = np.lexsort((p_doc, p_term))
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(p_term, minlength=len(terms)))
+        tf_dtype = np.uint16 if p_tf.size == 0 or p_tf.max() <= np.iinfo(np.uint16).max else np.uint32
+        return cls(terms, doc_ids, offsets, p_doc[order].astype(np.uint32), p_tf[order].astype(tf_dtype), doc_len, k1, b)
+
+    @property
+    def n_postings(self) -> int:
+        return int(self.docs.shape[0])
+
+    def save(self, index_dir: str) -> Dict:
+        np.savez(
+            os.path.join(index_dir, POSTINGS_NAME),
+            offsets=self.offsets,
+            doc=self.docs.astype(np.uint32),
+            tf=self.tfs,
+            doc_len=self.doc_len,
+        )
+        with open(os.path.join(index_dir, TERMS_NAME), "w", encoding="utf-8") as f:
+            json.dump({"terms": self.terms, "doc_ids": self.doc_ids, "k1": self.k1, "b": self.b}, f, ensure_ascii=False)
+        return {
+            "postings": POSTINGS_NAME,
+            "terms": TERMS_NAME,
+            "k1": self.k1,
+            "b": self.b,
+            "n_terms": len(self.terms),
+            "n_postings": self.n_postings,
+        }
+
+    @classmethod
+    def load(cls, index_dir: str) -> "BM25Index":
+        with open(os.path.join(index_dir, TERMS_NAME), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with np.load(os.path.join(index_dir, POSTINGS_NAME)) as data:
+            return cls(
+                meta["terms"],
+                meta["doc_ids"],
+                data["offsets"],
+                data["doc"],
+                data["tf"],
+                data["doc_len"],
+                meta.get("k1", K1),
+                meta.get("b", B),
+            )
+
+    def scores(self, terms: List[str]) -> np.ndarray:
+        """BM25 score of every doc; a repeated query term counts repeatedly."""
+        rows = [self.term_row[t] for t in terms if t in self.term_row]
+        if not rows:
+            return np.zeros(len(self.doc_ids), dtype=np.float32)
+        if len(rows) == 1:
+            sl = slice(self.offsets[rows[0]], self.offsets[rows[0] + 1])
+            docs, weights = self.docs[sl], self.weights[sl]
+        else:
+            idx = np.concatenate([np.arange(self.offsets[r], self.offsets[r + 1]) for r in rows])
+            docs, weights = self.docs[idx], self.weights[idx]
+        return np.bincount(docs, weights=weights, minlength=len(self.doc_ids)).astype(np.float32)
+
+    def search(self, terms: List[str], top: int) -> List[Tuple[str, float]]:
+        """Best docs with a positive score, best first."""
+        scores = self.scores(terms)
+        hit = np.flatnonzero(scores > 0)
+        if hit.size == 0 or top <= 0:
+            return []
+        if hit.size > top:
+            hit = hit[np.argpartition(-scores[hit], top - 1)[:top]]
+        hit = hit[np.lexsort((hit, -scores[hit]))]
+        return [(self.doc_ids[i], float(scores[i])) for i in hit]
+
+
+def exists(index_dir: str) -> bool:
+    return os.path.exists(os.path.join(index_dir, POSTINGS_NAME)) and os.path.exists(
+        os.path.join(index_dir, TERMS_NAME)
+    )
+
+
+def rrf(rankings: Sequence[Sequence[Tuple[str, float]]], top: int, k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Reciprocal-rank fusion: sum of 1 / (k + rank) over the rankings a doc appears in."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    # ties: first-seen order, i.e. the earlier ranking wins
+    return sorted(fused.items(), key=lambda item: -item[1])[:top]
+
+
+def best_paragraph(paragraphs: List[str], terms: List[str]) -> str | None:
+    """Paragraph containing the most distinct query terms (first one on ties)."""
+    wanted = set(terms)
+    best = None
+    best_hits = -1
+    for text in paragraphs:
+        hits = len(wanted.intersection(query_terms(text)))
+        if hits > best_hits:
+            best, best_hits = text, hits
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("query")
+    parser.add_argument("--index-dir", required=True, help="directory holding bm25_postings.npz")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200, help="repetitions for the latency figure")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    index = BM25Index.load(args.index_dir)
+    load_ms = (time.perf_counter() - t0) * 1000
+    terms = query_terms(args.query)
+    t0 = time.perf_counter()
+    for _ in range(args.repeat):
+        hits = index.search(terms, args.top)
+    query_ms = (time.perf_counter() - t0) * 1000 / max(1, args.repeat)
+    print(f"{len(index.terms)} terms, {index.n_postings} postings; load {load_ms:.1f} ms, query {query_ms:.3f} ms")
+    for doc_id, score in hits:
+        print(f"  {doc_id}\t{score:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,23 @@
 
 from __future__ import annotations
 
+import argparse
 import json
 import os
 import re
-import hashlib
+import time
 from collections import Counter
 from datetime import datetime, timezone
 from typing import Dict, Iterable, List, Tuple
 
+import numpy as np
+
+from ann_index import build_and_save, index_path
+from bm25_index import BM25Index
+from ngram_hash import DEFAULT_SCHEME, FeatureHasher, normalize_rows
+from vector_store import DOC_VECTORS
+from vector_store import save as save_vectors
+
 OUTPUT_DIR = "/Users/TH_1/Documents/Repo/ACO/data_processing/output"
 CORPUS_PATH = os.path.join(OUTPUT_DIR, "corpus.jsonl")
 SEARCH_DIR = os.path.join(OUTPUT_DIR, "search_index")
@@ -20,8 +29,11 @@ NGRAM_MIN = 3
 NGRAM_MAX = 5
 MIN_DF = 2
 DECIMALS = 6
+HASH_SCHEME = DEFAULT_SCHEME  # n-gram hash, see ngram_hash.py
+VECTOR_DTYPE = "float32"  # doc_vectors.npy; "float16" halves the file
 TOP_EXPANSION = 5
 MIN_SIM = 0.35
+ANN_LISTS = 0  # IVF lists for doc_ann_ivf.npz; 0 = sqrt(docs)
 
 TOKEN_RE = re.compile(r"[A-Za-z\u00C0-\u024F\u0370-\u03FF\u1F00-\u1FFF]+")
 
@@ -44,43 +56,8 @@ def tokenize(text: str) -> List[str]:
     return [t.lower() for t in TOKEN_RE.findall(text or "")]
 
 
-def hash_to_index(token: str, dim: int) -> Tuple[int, int]:
-    digest = hashlib.md5(token.encode("utf-8")).digest()
-    idx = int.from_bytes(digest[:4], "little") % dim
-    sign = 1 if digest[4] % 2 == 0 else -1
-    return idx, sign
-
-
-def token_vector_sparse(token: str) -> List[Tuple[int, float]]:
-    token = token.lower()
-    t = f"<{token}>"
-    feats: Dict[int, float] = {}
-
-    # char n-grams
-    for n in range(NGRAM_MIN, NGRAM_MAX + 1):
-        if len(t) < n:
-            continue
-        for i in range(len(t) - n + 1):
-            ngram = t[i : i + n]
-            idx, sign = hash_to_index(ngram, DIM)
-            feats[idx] = feats.get(idx, 0.0) + float(sign)
-
-    # full token hash
-    idx, sign = hash_to_index(token, DIM)
-    feats[idx] = feats.get(idx, 0.0) + float(sign)
-
-    return list(feats.items())
-
-
-def l2_normalize(vec: List[float]) -> List[float]:
-    norm = sum(v * v for v in vec) ** 0.5
-    if norm == 0:
-        return vec
-    return [v / norm for v in vec]
-
-
-def quantize(vec: List[float]) -> List[float]:
-    return [round(v, DECIMALS) for v in vec]
+def quantize_rows(mat: np.ndarray) -> List[List[float]]:
+    return np.round(mat, DECIMALS).tolist()
 
 
 def read_jsonl(path: str) -> Iterable[Dict]:
@@ -103,69 +80,202 @@ def write_jsonl(path: str, rows: Iterable[Dict]) -> None:
             f.write(json.dumps(row, ensure_ascii=False) + "\n")
 
 
-def build_index() -> None:
-    os.makedirs(SEARCH_DIR, exist_ok=True)
+def vocab_neighbours(matrix: np.ndarray, k: int, min_sim: float, block: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k neighbours (row, similarity) of every vocab row with similarity >= min_sim.
 
-    docs_meta: List[Dict] = []
-    doc_tokens: Dict[str, List[str]] = {}
-    df = Counter()
+    Rows have fewer than k neighbours padded with index -1. Ties keep vocab order,
+    matching the live ranking in search_query.expand_query.
+    """
+    n = matrix.shape[0]
+    idx = np.full((n, k), -1, dtype=np.int32)
+    sims = np.zeros((n, k), dtype=np.float32)
+    for start in range(0, n, block):
+        scores = matrix[start : start + block] @ matrix.T
+        rows = np.arange(scores.shape[0])
+        scores[rows, start + rows] = -np.inf
+        for r, row in enumerate(scores):
+            cand = np.flatnonzero(row >= min_sim)
+            best = cand[np.argsort(-row[cand], kind="stable")][:k]
+            idx[start + r, : best.shape[0]] = best
+            sims[start + r, : best.shape[0]] = row[best]
+    return idx, sims
+
+
+def weighted_row_sums(groups: List[np.ndarray], token_matrix: np.ndarray) -> np.ndarray:
+    """One row per group of token ids: the count-weighted sum of their token_matrix rows.
+
+    Rows are added in ascending id order with plain NumPy adds (no BLAS), so a
+    group gives the same bits whatever else is in the batch.
+    """
+    out = np.zeros((len(groups), token_matrix.shape[1]), dtype=np.float64)
+    for i, ids in enumerate(groups):
+        if ids.size:
+            uniq, counts = np.unique(ids, return_counts=True)
+            out[i] = (counts.astype(np.float64)[:, None] * token_matrix[uniq]).sum(axis=0)
+    return out
 
-    for row in read_jsonl(CORPUS_PATH):
-        doc_id = row.get("doc_id")
-        title = row.get("title")
-        lang = row.get("lang")
-        metadata = row.get("metadata", {})
-        text = normalize_space(" ".join([row.get("text_main", ""), row.get("text_notes", "")]))
-        tokens = [t for t in tokenize(text) if len(t) >= 2 and t not in STOPWORDS]
-        doc_tokens[doc_id] = tokens
 
-        for t in set(tokens):
-            df[t] += 1
+def stack_rows(parts: List[np.ndarray]) -> np.ndarray:
+    parts = [p for p in parts if p.shape[0]]
+    return np.concatenate(parts, axis=0) if parts else np.zeros((0, DIM), dtype=np.float64)
+
+
+def content_tokens(text: str) -> List[str]:
+    return [t for t in tokenize(text) if len(t) >= 2 and t not in STOPWORDS]
+
 
+# one per process, so n-grams shared between shards are hashed once per worker
+_SHARD_HASHER: FeatureHasher | None = None
+
+
+def shard_hasher(dim: int, ngram_min: int, ngram_max: int, scheme: str) -> FeatureHasher:
+    global _SHARD_HASHER
+    hasher = _SHARD_HASHER
+    if hasher is None or (hasher.dim, hasher.ngram_min, hasher.ngram_max, hasher.scheme) != (dim, ngram_min, ngram_max, scheme):
+        hasher = _SHARD_HASHER = FeatureHasher(dim, ngram_min, ngram_max, scheme)
+    return hasher
+
+
+def embed_shard(rows: List[Dict], dim: int, ngram_min: int, ngram_max: int, scheme: str) -> Dict:
+    """Tokenize and embed a contiguous run of corpus rows (one worker task).
+
+    Token ids are assigned in sorted token order, so every doc and paragraph sum
+    adds the same rows in the same order as in any other sharding: the merged
+    output does not depend on the worker count. Vectors are returned unnormalized.
+    """
+    hasher = shard_hasher(dim, ngram_min, ngram_max, scheme)
+    docs_meta: List[Dict] = []
+    doc_tokens: List[List[str]] = []
+    paragraph_tokens: List[List[List[str]]] = []
+    df = Counter()
+    for row in rows:
+        text = normalize_space(" ".join([row.get("text_main", ""), row.get("text_notes", "")]))
+        tokens = content_tokens(text)
+        doc_tokens.append(tokens)
+        paragraph_tokens.append([content_tokens(p) for p in row.get("paragraphs") or []])
+        df.update(set(tokens))
         docs_meta.append(
             {
-                "doc_id": doc_id,
-                "title": title,
-                "lang": lang,
-                "metadata": metadata,
+                "doc_id": row.get("doc_id"),
+                "title": row.get("title"),
+                "lang": row.get("lang"),
+                "metadata": row.get("metadata", {}),
                 "token_count": len(tokens),
                 "text_len": len(text),
                 "snippet": text[:400],
             }
         )
 
+    # one hashed row per distinct token; vectors are count-weighted sums of rows
+    distinct = {t for tokens in doc_tokens for t in tokens}
+    distinct.update(t for paras in paragraph_tokens for p in paras for t in p)
+    shard_tokens = sorted(distinct)
+    token_row = {tok: i for i, tok in enumerate(shard_tokens)}
+    token_matrix = hasher.token_matrix(shard_tokens)
+    doc_groups = [np.asarray([token_row[t] for t in tokens], dtype=np.int64) for tokens in doc_tokens]
+    para_groups = [np.asarray([token_row[t] for t in p], dtype=np.int64) for paras in paragraph_tokens for p in paras]
+    return {
+        "docs_meta": docs_meta,
+        "doc_tokens": doc_tokens,
+        "paragraph_counts": [len(paras) for paras in paragraph_tokens],
+        "df": df,
+        "tokens": shard_tokens,
+        "doc_sums": weighted_row_sums(doc_groups, token_matrix),
+        "paragraph_sums": weighted_row_sums(para_groups, token_matrix),
+    }
+
+
+def _embed_shard_task(args: Tuple) -> Dict:
+    return embed_shard(*args)
+
+
+def shard_rows(rows: List[Dict], n_shards: int) -> List[List[Dict]]:
+    """Contiguous shards of about equal text size (corpus order is kept)."""
+    sizes = np.cumsum([len(r.get("text_main", "")) + len(r.get("text_notes", "")) + 1 for r in rows])
+    if not rows:
+        return []
+    bounds = np.searchsorted(sizes, sizes[-1] * np.arange(1, n_shards) / n_shards, side="right")
+    edges = [0] + [int(b) for b in bounds] + [len(rows)]
+    return [rows[a:b] for a, b in zip(edges, edges[1:]) if b > a]
+
+
+def build_index(workers: int = 1) -> None:
+    """Build the index; workers > 1 embeds corpus shards in a process pool (same output bytes)."""
+    os.makedirs(SEARCH_DIR, exist_ok=True)
+    t0 = time.perf_counter()
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+
+    rows = list(read_jsonl(CORPUS_PATH))
+    settings = (DIM, NGRAM_MIN, NGRAM_MAX, HASH_SCHEME)
+    if workers == 1:
+        shards = [embed_shard(rows, *settings)]
+    else:
+        import multiprocessing
+
+        # a few shards per worker evens out long and short documents
+        tasks = [(shard, *settings) for shard in shard_rows(rows, workers * 4)]
+        with multiprocessing.Pool(workers) as pool:
+            shards = pool.map(_embed_shard_task, tasks, chunksize=1)
+
+    # merge in shard (= corpus) order
+    docs_meta: List[Dict] = [meta for shard in shards for meta in shard["docs_meta"]]
+    doc_tokens = [tokens for shard in shards for tokens in shard["doc_tokens"]]
+    df = Counter()
+    distinct_tokens = set()
+    for shard in shards:
+        df.update(shard["df"])
+        distinct_tokens.update(shard["tokens"])
+    # paragraph rows follow corpus "paragraphs" order, one doc after the other
+    paragraph_index: List[Dict] = []
+    n_paragraphs = 0
+    for meta, count in zip(docs_meta, (c for shard in shards for c in shard["paragraph_counts"])):
+        if count:
+            paragraph_index.append({"doc_id": meta["doc_id"], "start": n_paragraphs, "count": count})
+            n_paragraphs += count
+
     vocab = {t for t, c in df.items() if c >= MIN_DF and len(t) >= 3 and t not in STOPWORDS}
 
-    token_cache: Dict[str, List[Tuple[int, float]]] = {}
-
-    def get_token_sparse(tok: str) -> List[Tuple[int, float]]:
-        if tok not in token_cache:
-            token_cache[tok] = token_vector_sparse(tok)
-        return token_cache[tok]
-
-    # document embeddings
-    doc_embeddings = []
-    for meta in docs_meta:
-        doc_id = meta["doc_id"]
-        vec = [0.0] * DIM
-        for tok in doc_tokens.get(doc_id, []):
-            for idx, val in get_token_sparse(tok):
-                vec[idx] += val
-        vec = l2_normalize(vec)
-        doc_embeddings.append({"doc_id": doc_id, "vector": quantize(vec)})
-
-    # vocab embeddings
-    vocab_rows = []
-    for tok in sorted(vocab):
-        vec = [0.0] * DIM
-        for idx, val in get_token_sparse(tok):
-            vec[idx] += val
-        vec = l2_normalize(vec)
-        vocab_rows.append({"token": tok, "df": df[tok], "vector": quantize(vec)})
+    # document and paragraph embeddings (paragraphs: same weighting as the docs)
+    doc_matrix = normalize_rows(stack_rows([shard["doc_sums"] for shard in shards])).astype(np.float32)
+    paragraph_matrix = normalize_rows(stack_rows([shard["paragraph_sums"] for shard in shards])).astype(np.float32)
+
+    # vocab embeddings (every vocab token occurs in some doc, so it has a row)
+    vocab_tokens = sorted(vocab)
+    vocab_vectors = normalize_rows(shard_hasher(*settings).token_matrix(vocab_tokens).reshape(-1, DIM))
+    vocab_rows = [
+        {"token": tok, "df": df[tok], "vector": vec} for tok, vec in zip(vocab_tokens, quantize_rows(vocab_vectors))
+    ]
 
     write_jsonl(os.path.join(SEARCH_DIR, "docs.jsonl"), docs_meta)
-    write_jsonl(os.path.join(SEARCH_DIR, "doc_embeddings.jsonl"), doc_embeddings)
+    write_jsonl(os.path.join(SEARCH_DIR, "paragraph_index.jsonl"), paragraph_index)
+    np.save(os.path.join(SEARCH_DIR, "paragraph_embeddings.npy"), paragraph_matrix)
+    vectors_meta = save_vectors(
+        SEARCH_DIR,
+        DOC_VECTORS,
+        [meta["doc_id"] for meta in docs_meta],
+        doc_matrix,
+        model=f"char_ngram_hash:{HASH_SCHEME}:{DIM}:{NGRAM_MIN}-{NGRAM_MAX}",
+        dtype=VECTOR_DTYPE,
+    )
     write_jsonl(os.path.join(SEARCH_DIR, "vocab.jsonl"), vocab_rows)
+    # same vocab as a float32 matrix + token list, so expansion needs no JSON parse
+    vocab_matrix = np.asarray([r["vector"] for r in vocab_rows], dtype=np.float32).reshape(len(vocab_rows), DIM)
+    np.save(os.path.join(SEARCH_DIR, "vocab_vectors.npy"), vocab_matrix)
+    write_json(os.path.join(SEARCH_DIR, "vocab_tokens.json"), {"tokens": [r["token"] for r in vocab_rows]})
+    knn_idx, knn_sims = vocab_neighbours(vocab_matrix, TOP_EXPANSION, MIN_SIM)
+    np.savez(
+        os.path.join(SEARCH_DIR, "vocab_knn.npz"),
+        indices=knn_idx,
+        sims=knn_sims,
+        k=np.int64(TOP_EXPANSION),
+        min_sim=np.float32(MIN_SIM),
+    )
+
+    ann_meta = {"doc": build_and_save(index_path(SEARCH_DIR, "doc"), doc_matrix, n_lists=ANN_LISTS)}
+
+    # lexical inverted index over the same tokens
+    bm25_meta = BM25Index.build([(m["doc_id"], tokens) for m, tokens in zip(docs_meta, doc_tokens)]).save(SEARCH_DIR)
 
     write_json(
         os.path.join(SEARCH_DIR, "index_meta.json"),
@@ -174,26 +284,48 @@ def build_index() -> None:
             "corpus": os.path.abspath(CORPUS_PATH),
             "embedding": {
                 "method": "char_ngram_hash",
+                "hash": HASH_SCHEME,
                 "dim": DIM,
                 "ngram_min": NGRAM_MIN,
                 "ngram_max": NGRAM_MAX,
                 "min_df": MIN_DF,
                 "stopwords": len(STOPWORDS),
                 "decimals": DECIMALS,
+                "vectors": vectors_meta,
             },
             "query_expansion": {
                 "top_k": TOP_EXPANSION,
                 "min_sim": MIN_SIM,
                 "source": "vocab.jsonl",
+                "matrix": "vocab_vectors.npy",
+                "tokens": "vocab_tokens.json",
+                "knn": "vocab_knn.npz",
+            },
+            "paragraphs": {
+                "source": "corpus.jsonl:paragraphs",
+                "vectors": "paragraph_embeddings.npy",
+                "index": "paragraph_index.jsonl",
             },
+            "ann": ann_meta,
+            "bm25": bm25_meta,
             "counts": {
                 "docs": len(docs_meta),
                 "vocab": len(vocab_rows),
+                "paragraphs": n_paragraphs,
             },
         },
     )
+    print(
+        f"{len(docs_meta)} docs, {len(vocab_rows)} vocab tokens, {len(distinct_tokens)} distinct tokens "
+        f"hashed ({HASH_SCHEME}) in {time.perf_counter() - t0:.2f}s with {workers} worker(s)"
+    )
 
 
 if __name__ == "__main__":
-    build_index()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--workers", type=int, default=1, help="processes embedding corpus shards (0 = one per CPU); output is identical"
+    )
+    args = parser.parse_args()
+    build_index(workers=args.workers)
     print("Search index built")
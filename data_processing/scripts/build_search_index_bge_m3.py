@@ -10,21 +10,48 @@ Example:
 
 If --model-path is not provided, the script uses 'BAAI/bge-m3' which
 requires network access to download from Hugging Face.
+
+Builds are incremental: content_hashes.json records the sha256 of every doc,
+chunk and paragraph text together with the model snapshot. The next build with
+the same snapshot and quantization re-embeds only texts it has not seen. Other
+vectors are carried over from chunk_vectors.npy and paragraph_embeddings.npy,
+and vectors of deleted docs are dropped. --full ignores the previous build.
+
+If the snapshot ships BGE-M3's sparse head (sparse_linear.pt), the same
+forward pass also yields each chunk's lexical token weights; they are stored
+as an inverted index (sparse_postings.npz, see bge_m3_sparse.py).
 """
 
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
 import os
 import re
+import time
 from datetime import datetime, timezone
-from typing import Dict, Iterable, List
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from ann_index import build_and_save, index_path
+from bge_m3_quantization import QUANTIZATION_MODES, model_device, quantize_model
+from bge_m3_sparse import SparseIndex, load_chunk_weights, load_sparse_head, max_pool, save_chunk_weights, token_weights
+from bge_m3_sparse import remove as remove_sparse
+from multi_vector import CHUNK_INDEX, CHUNK_VECTORS
+from vector_store import DOC_VECTORS, DTYPES
+from vector_store import exists as vectors_exist
+from vector_store import load as load_vectors
+from vector_store import save as save_vectors
 
 OUTPUT_DIR = "/Users/TH_1/Documents/Repo/ACO/data_processing/output"
 CORPUS_PATH = os.path.join(OUTPUT_DIR, "corpus.jsonl")
 SEARCH_DIR = os.path.join(OUTPUT_DIR, "search_index_bge_m3")
 
+MANIFEST_NAME = "content_hashes.json"
+MANIFEST_FORMAT = 1
+
 
 def normalize_space(text: str) -> str:
     return re.sub(r"\s+", " ", text or "").strip()
@@ -50,11 +77,11 @@ def write_jsonl(path: str, rows: Iterable[Dict]) -> None:
             f.write(json.dumps(row, ensure_ascii=False) + "\n")
 
 
-def chunk_text(text: str, max_chars: int) -> List[str]:
-    text = normalize_space(text)
+def chunk_spans(text: str, max_chars: int) -> List[Tuple[int, int]]:
+    """Character windows of at most max_chars, cut at a sentence end where possible."""
     if len(text) <= max_chars:
-        return [text]
-    chunks = []
+        return [(0, len(text))] if text else []
+    spans = []
     start = 0
     while start < len(text):
         end = min(len(text), start + max_chars)
@@ -62,9 +89,70 @@ def chunk_text(text: str, max_chars: int) -> List[str]:
         cut = text.rfind(".", start, end)
         if cut == -1 or cut < start + max_chars * 0.5:
             cut = end
-        chunks.append(text[start:cut].strip())
+        a, b = start, cut
+        while a < b and text[a].isspace():
+            a += 1
+        while b > a and text[b - 1].isspace():
+            b -= 1
+        if b > a:
+            spans.append((a, b))
         start = cut
-    return [c for c in chunks if c]
+    return spans
+
+
+def chunk_text(text: str, max_chars: int) -> List[str]:
+    text = normalize_space(text)
+    return [text[a:b] for a, b in chunk_spans(text, max_chars)]
+
+
+def token_window_spans(text: str, tokenizer, window: int, overlap: int) -> List[Tuple[int, int]]:
+    """Character spans of at most `window` tokens, each starting `overlap` tokens before the last one ends.
+
+    Needs a fast tokenizer (offset mapping). A span cut out of the doc can
+    tokenize longer on its own than in context (it starts mid-word or with a
+    word-initial marker), so each one is re-tokenized and shortened until it
+    fits. The last window ends at the last token, so no text is left out.
+    """
+    offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)["offset_mapping"]
+    if not offsets:
+        return [(0, len(text))] if text.strip() else []
+
+    def standalone_tokens(start: int, end: int) -> int:
+        span = text[offsets[start][0] : offsets[end - 1][1]]
+        return len(tokenizer(span, add_special_tokens=False, verbose=False)["input_ids"])
+
+    spans = []
+    start = 0
+    while True:
+        end = min(start + window, len(offsets))
+        while end - start > 1 and standalone_tokens(start, end) > window:
+            end -= 1
+        spans.append((offsets[start][0], offsets[end - 1][1]))
+        if end == len(offsets):
+            break
+        start = max(start + 1, end - overlap)
+    return spans
+
+
+def paragraph_spans(text: str, paragraphs: List[str]) -> List[Tuple[int, int] | None]:
+    """Where each (normalized) paragraph occurs in the doc text, searching left to right; None if not found."""
+    spans: List[Tuple[int, int] | None] = []
+    pos = 0
+    for para in paragraphs:
+        para = normalize_space(para)
+        i = text.find(para, pos) if para else -1
+        if i < 0:
+            spans.append(None)
+            continue
+        spans.append((i, i + len(para)))
+        pos = i + len(para)
+    return spans
+
+
+def covered_paragraphs(span: Tuple[int, int], para_spans: List[Tuple[int, int] | None]) -> List[int]:
+    """[first, last] paragraph overlapping a chunk span, or [] if none does."""
+    hit = [i for i, p in enumerate(para_spans) if p is not None and p[0] < span[1] and span[0] < p[1]]
+    return [hit[0], hit[-1]] if hit else []
 
 def resolve_model_path(model_path: str) -> str:
     # If given a HF cache root, resolve to the latest snapshot path
@@ -91,6 +179,54 @@ def resolve_model_path(model_path: str) -> str:
     return model_path
 
 
+def model_snapshot_id(resolved_model_path: str) -> str:
+    """Identity of the weights: "<repo>@<snapshot>" in a HF cache, else the path plus its newest file mtime."""
+    parent = os.path.dirname(resolved_model_path.rstrip(os.sep))
+    if os.path.basename(parent) == "snapshots":
+        repo = os.path.basename(os.path.dirname(parent))
+        return f"{repo}@{os.path.basename(resolved_model_path.rstrip(os.sep))}"
+    if os.path.isdir(resolved_model_path):
+        mtimes = [
+            os.path.getmtime(os.path.join(resolved_model_path, name))
+            for name in os.listdir(resolved_model_path)
+            if os.path.isfile(os.path.join(resolved_model_path, name))
+        ]
+        return f"{os.path.abspath(resolved_model_path)}@{int(max(mtimes, default=0))}"
+    return resolved_model_path
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def load_previous_vectors(model_id: str) -> Tuple[Dict[str, np.ndarray], Dict[str, str], Dict[str, int] | None]:
+    """(text hash -> vector, doc_id -> doc hash, text hash -> tokens truncated) from the last build.
+
+    Empty if that build used another model. The truncation map lists only
+    truncated texts; it is None for manifests written before it was recorded.
+    """
+    path = os.path.join(SEARCH_DIR, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}, {}, {}
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != MANIFEST_FORMAT or manifest.get("model") != model_id:
+        print(f"Previous index was built with {manifest.get('model')}; re-embedding everything")
+        return {}, {}, {}
+    vectors: Dict[str, np.ndarray] = {}
+    # copies, not memory maps: the files are overwritten by this build
+    if vectors_exist(SEARCH_DIR, CHUNK_VECTORS):
+        ids, mat, _ = load_vectors(SEARCH_DIR, CHUNK_VECTORS, mmap=False)
+        vectors.update(zip(ids, mat))
+    para_hashes = [h for doc in manifest["docs"] for h in doc["paragraphs"]]
+    para_path = os.path.join(SEARCH_DIR, "paragraph_embeddings.npy")
+    if para_hashes and os.path.exists(para_path):
+        mat = np.load(para_path)
+        if mat.shape[0] == len(para_hashes):
+            vectors.update(zip(para_hashes, mat))
+    return vectors, {doc["doc_id"]: doc["sha256"] for doc in manifest["docs"]}, manifest.get("truncated")
+
+
 def mean_pool(last_hidden_state, attention_mask):
     import torch
 
@@ -101,7 +237,145 @@ def mean_pool(last_hidden_state, attention_mask):
     return summed / counts
 
 
-def build_index(model_path: str, max_chars: int, batch_size: int) -> None:
+def encode(texts: List[str], tokenizer, model, device: str, batch_size: int):
+    """Mean-pooled, L2-normalized embeddings for texts, as a CPU tensor."""
+    import torch
+
+    all_embs = []
+    for i in range(0, len(texts), batch_size):
+        batch = texts[i : i + batch_size]
+        enc = tokenizer(
+            batch,
+            padding=True,
+            truncation=True,
+            return_tensors="pt",
+            max_length=tokenizer.model_max_length,
+        )
+        enc = {k: v.to(device) for k, v in enc.items()}
+        with torch.no_grad():
+            out = model(**enc)
+            pooled = mean_pool(out.last_hidden_state, enc["attention_mask"])
+            pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+        all_embs.append(pooled.cpu())
+    return torch.cat(all_embs, dim=0)
+
+
+def token_batches(lengths: List[int], max_tokens: int, max_batch: int) -> List[List[int]]:
+    """Indexes grouped longest first, so each batch pads to at most max_tokens (n * longest).
+
+    Similar lengths end up together, which keeps padding low; a text longer
+    than the budget still gets a batch of its own.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: (-lengths[i], i))
+    batches: List[List[int]] = []
+    for i in order:
+        # descending order: the first index of a batch is its longest
+        if batches and len(batches[-1]) < max_batch and (len(batches[-1]) + 1) * lengths[batches[-1][0]] <= max_tokens:
+            batches[-1].append(i)
+        else:
+            batches.append([i])
+    return batches
+
+
+def padded_tokens(lengths: List[int], batches: List[List[int]]) -> int:
+    return sum(len(b) * max(lengths[i] for i in b) for b in batches)
+
+
+def special_token_counts(tokenizer) -> Tuple[int, int]:
+    """Special tokens the tokenizer adds before and after a single text."""
+    bare = tokenizer("a", add_special_tokens=False)["input_ids"]
+    full = tokenizer("a")["input_ids"]
+    for i in range(len(full) - len(bare) + 1):
+        if full[i : i + len(bare)] == bare:
+            return i, len(full) - i - len(bare)
+    return tokenizer.num_special_tokens_to_add(), 0
+
+
+def truncate_ids(ids: List[int], max_length: int, n_suffix: int) -> List[int]:
+    """ids cut to max_length like the tokenizer's own truncation: text tokens go, special tokens stay."""
+    if len(ids) <= max_length:
+        return ids
+    return ids[: max_length - n_suffix] + ids[len(ids) - n_suffix :]
+
+
+def encode_token_batches(
+    texts: List[str], tokenizer, model, device: str, max_tokens: int, max_batch: int, sparse_head=None
+) -> Tuple[np.ndarray, List[int], List[Dict[int, float] | None], Dict]:
+    """Embed texts from the whole corpus in length-bucketed batches; rows follow the input order.
+
+    Every text is tokenized once and cut to the model window (truncate_ids), batches are
+    formed by token_batches() and padded from the stored ids. Returns the
+    vectors, the tokens cut off each text, the sparse token weights (None
+    without a sparse head) and the batch statistics (padding efficiency, tokens/s).
+    """
+    import torch
+
+    dim = model.config.hidden_size
+    if not texts:
+        return np.zeros((0, dim), dtype=np.float32), [], [], {"texts": 0, "batches": 0}
+    # untruncated, so the tokens that never reach the model can be counted
+    full = tokenizer(texts, verbose=False)["input_ids"]
+    _, n_suffix = special_token_counts(tokenizer)
+    input_ids = [truncate_ids(ids, tokenizer.model_max_length, n_suffix) for ids in full]
+    lengths = [len(ids) for ids in input_ids]
+    truncated = [len(ids) - n for ids, n in zip(full, lengths)]
+    batches = token_batches(lengths, max_tokens, max_batch)
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    sparse: List[Dict[int, float] | None] = [None] * len(texts)
+    t0 = time.perf_counter()
+    for batch in batches:
+        padded = tokenizer.pad(
+            {"input_ids": [input_ids[i] for i in batch], "attention_mask": [[1] * lengths[i] for i in batch]},
+            return_tensors="pt",
+        )
+        padded = {k: v.to(device) for k, v in padded.items()}
+        with torch.no_grad():
+            hidden = model(**padded).last_hidden_state
+            pooled = torch.nn.functional.normalize(mean_pool(hidden, padded["attention_mask"]), p=2, dim=1)
+        out[batch] = pooled.float().cpu().numpy()
+        if sparse_head is not None:
+            weights = token_weights(
+                hidden, padded["input_ids"], padded["attention_mask"], sparse_head, tokenizer.all_special_ids
+            )
+            for i, w in zip(batch, weights):
+                sparse[i] = w
+    seconds = time.perf_counter() - t0
+    real = sum(lengths)
+    padded_total = padded_tokens(lengths, batches)
+    # what fixed batches of max_batch in input order would have padded to
+    fixed = [list(range(i, min(i + max_batch, len(texts)))) for i in range(0, len(texts), max_batch)]
+    stats = {
+        "texts": len(texts),
+        "batches": len(batches),
+        "tokens": real,
+        "padded_tokens": padded_total,
+        "padding_efficiency": round(real / padded_total, 4),
+        "padding_efficiency_input_order": round(real / padded_tokens(lengths, fixed), 4),
+        "seconds": round(seconds, 3),
+        "tokens_per_s": round(real / seconds, 1) if seconds else 0.0,
+    }
+    return out, truncated, sparse, stats
+
+
+def build_index(
+    model_path: str,
+    max_chars: int = 4000,
+    batch_size: int = 64,
+    max_tokens: int = 16384,
+    quantize: str = "none",
+    ann_lists: int = 0,
+    vector_dtype: str = "float32",
+    incremental: bool = True,
+    chunk_tokens: int = 1024,
+    chunk_overlap: int = 128,
+) -> None:
+    """Build the index; chunks and paragraphs of all docs are embedded together.
+
+    Docs are cut into windows of chunk_tokens tokens overlapping by chunk_overlap,
+    capped at the model window (max_chars character chunks only without a fast
+    tokenizer). batch_size caps the texts per forward pass, max_tokens the
+    padded tokens (texts x longest text) per pass.
+    """
     try:
         from transformers import AutoTokenizer, AutoModel
         import torch
@@ -111,15 +385,72 @@ def build_index(model_path: str, max_chars: int, batch_size: int) -> None:
         ) from exc
 
     os.makedirs(SEARCH_DIR, exist_ok=True)
+    t0 = time.perf_counter()
 
-    device = "cuda" if torch.cuda.is_available() else "cpu"
+    device = model_device(quantize, "cuda" if torch.cuda.is_available() else "cpu")
     resolved_model_path = resolve_model_path(model_path)
-    tokenizer = AutoTokenizer.from_pretrained(resolved_model_path, use_fast=False)
+    # quantized weights give different vectors, so they are a different model for the cache
+    model_id = f"{model_snapshot_id(resolved_model_path)}:{quantize}"
+    previous, previous_docs, previous_cut = load_previous_vectors(model_id) if incremental else ({}, {}, {})
+    # one tokenizer sizes the chunk windows and encodes them, so a window that fits stays within the model window
+    tokenizer = AutoTokenizer.from_pretrained(resolved_model_path, use_fast=True)
     model = AutoModel.from_pretrained(resolved_model_path).to(device)
     model.eval()
+    model = quantize_model(model, quantize)
+    sparse_head = load_sparse_head(resolved_model_path, model.config.hidden_size)
+    if sparse_head is None:
+        print(f"No {resolved_model_path}/sparse_linear.pt; building without the sparse lexical index")
+        previous_sparse: Dict[str, Dict[int, float]] = {}
+    else:
+        sparse_head = sparse_head.to(device)
+        # empty unless the manifest matched, like `previous`
+        previous_sparse = load_chunk_weights(SEARCH_DIR) if previous else {}
+
+    # chunk boundaries come from the fast tokenizer's offsets (the slow one has none)
+    window = min(chunk_tokens, tokenizer.model_max_length - tokenizer.num_special_tokens_to_add())
+    if not 0 <= chunk_overlap < window:
+        raise SystemExit(f"--chunk-overlap must be between 0 and the window size ({window} tokens)")
+    if tokenizer.is_fast:
+        chunking = {"method": "tokens", "window": window, "overlap": chunk_overlap}
+    else:
+        print(f"No fast tokenizer for {resolved_model_path}; falling back to {max_chars}-character chunks")
+        chunking = {"method": "chars", "max_chars": max_chars}
+
+    # pass 1: hash every chunk and paragraph, queue the texts no earlier build embedded
+    pending: Dict[str, str] = {}
+    # "reused": taken from the previous build, or a duplicate of a text already queued
+    stats = {"chunks_reused": 0, "chunks_recomputed": 0, "paragraphs_reused": 0, "paragraphs_recomputed": 0}
+
+    pending_kind: Dict[str, str] = {}
+    # tokens cut off each text at the model window, reused texts included
+    known_cut: Dict[str, int] = {}
+
+    def overflow(text: str) -> int:
+        return max(0, len(tokenizer(text, verbose=False)["input_ids"]) - tokenizer.model_max_length)
+
+    def reusable(h: str, kind: str) -> bool:
+        # chunks of a build without sparse weights are re-embedded to get them
+        if kind == "chunks" and sparse_head is not None and h not in previous_sparse:
+            return False
+        return h in previous
+
+    def queue(texts: List[str], kind: str) -> List[str]:
+        hashes = [text_sha256(t) for t in texts]
+        for h, t in zip(hashes, texts):
+            if reusable(h, kind) or h in pending:
+                stats[f"{kind}_reused"] += 1
+                if h not in pending and h not in known_cut:
+                    # manifests from before truncation was recorded: count it once here
+                    known_cut[h] = previous_cut.get(h, 0) if previous_cut is not None else overflow(t)
+            else:
+                pending[h] = t
+                pending_kind[h] = kind
+                stats[f"{kind}_recomputed"] += 1
+        return hashes
 
     docs_meta: List[Dict] = []
-    embeddings_rows: List[Dict] = []
+    manifest_docs: List[Dict] = []
+    doc_changes = {"new": 0, "changed": 0, "unchanged": 0}
 
     for row in read_jsonl(CORPUS_PATH):
         doc_id = row.get("doc_id")
@@ -139,35 +470,146 @@ def build_index(model_path: str, max_chars: int, batch_size: int) -> None:
             }
         )
 
-        chunks = chunk_text(text, max_chars=max_chars)
-        if not chunks:
-            embeddings_rows.append({"doc_id": doc_id, "vector": []})
-            continue
+        paras = row.get("paragraphs") or []
+        doc_hash = text_sha256(json.dumps([text, paras], ensure_ascii=False))
+        if doc_id not in previous_docs:
+            doc_changes["new"] += 1
+        else:
+            doc_changes["unchanged" if previous_docs[doc_id] == doc_hash else "changed"] += 1
+        if chunking["method"] == "tokens":
+            spans = token_window_spans(text, tokenizer, window, chunk_overlap)
+        else:
+            spans = chunk_spans(text, max_chars)
+        para_spans = paragraph_spans(text, paras)
+        manifest_docs.append(
+            {
+                "doc_id": doc_id,
+                "sha256": doc_hash,
+                "chunks": queue([text[a:b] for a, b in spans], "chunks"),
+                "chunk_spans": [[a, b] for a, b in spans],
+                "chunk_paragraphs": [covered_paragraphs(span, para_spans) for span in spans],
+                "paragraphs": queue(paras, "paragraphs"),
+            }
+        )
 
-        all_embs = []
-        for i in range(0, len(chunks), batch_size):
-            batch = chunks[i : i + batch_size]
-            enc = tokenizer(
-                batch,
-                padding=True,
-                truncation=True,
-                return_tensors="pt",
-                max_length=tokenizer.model_max_length,
+    if chunking["method"] == "tokens":
+        # token_window_spans() sizes every chunk to fit; say so before the forward pass if one does not
+        too_long = sum(1 for h, kind in pending_kind.items() if kind == "chunks" and overflow(pending[h]))
+        if too_long:
+            print(
+                f"warning: {too_long} chunks exceed the model window of {tokenizer.model_max_length} tokens "
+                "and will be truncated"
             )
-            enc = {k: v.to(device) for k, v in enc.items()}
-            with torch.no_grad():
-                out = model(**enc)
-                pooled = mean_pool(out.last_hidden_state, enc["attention_mask"])
-                pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
-            all_embs.append(pooled.cpu())
-
-        emb = torch.cat(all_embs, dim=0).mean(dim=0)
-        emb = torch.nn.functional.normalize(emb, p=2, dim=0)
-        embeddings_rows.append({"doc_id": doc_id, "vector": emb.tolist()})
 
+    # one scheduler over all new texts of the corpus
+    vecs, cut, sparse, batching = encode_token_batches(
+        list(pending.values()), tokenizer, model, device, max_tokens, batch_size, sparse_head
+    )
+    computed = dict(zip(pending, vecs))
+    # kept for paragraphs too: a chunk can have the same text as a queued paragraph
+    computed_sparse = {h: w for h, w in zip(pending, sparse) if w is not None}
+    # text beyond the model window that was embedded without its tail
+    truncation = {kind: {"texts": 0, "tokens": 0} for kind in ("chunks", "paragraphs")}
+    known_cut.update(zip(pending, cut))
+    for doc in manifest_docs:
+        for kind in truncation:
+            for h in doc[kind]:
+                if known_cut[h]:
+                    truncation[kind]["texts"] += 1
+                    truncation[kind]["tokens"] += known_cut[h]
+
+    def vector(h: str) -> np.ndarray:
+        return computed[h] if h in computed else previous[h]
+
+    def lexical_weights(h: str) -> Dict[int, float]:
+        return computed_sparse[h] if h in computed_sparse else previous_sparse[h]
+
+    # pass 2: scatter vectors back to their docs
+    doc_ids: List[str] = []
+    doc_vectors: List[np.ndarray] = []
+    chunk_ids: List[str] = []
+    chunk_vectors: List[np.ndarray] = []
+    # sparse weights per chunk row, and their per-token max per doc row
+    chunk_sparse: List[Dict[int, float]] = []
+    doc_sparse: List[Dict[int, float]] = []
+    # chunk rows of each doc, with char spans in the doc text and the paragraphs they cover
+    chunk_index: List[Dict] = []
+    # paragraph vectors for snippet selection; rows follow corpus "paragraphs" order
+    paragraph_index: List[Dict] = []
+    paragraph_embs: List[np.ndarray] = []
+    paragraph_rows = 0
+    for doc in manifest_docs:
+        if doc["paragraphs"]:
+            paragraph_embs.extend(vector(h) for h in doc["paragraphs"])
+            paragraph_index.append({"doc_id": doc["doc_id"], "start": paragraph_rows, "count": len(doc["paragraphs"])})
+            paragraph_rows += len(doc["paragraphs"])
+        if not doc["chunks"]:
+            continue
+        vecs = [vector(h) for h in doc["chunks"]]
+        chunk_index.append(
+            {
+                "doc_id": doc["doc_id"],
+                "start": len(chunk_ids),
+                "count": len(doc["chunks"]),
+                "spans": doc["chunk_spans"],
+                "paragraphs": doc["chunk_paragraphs"],
+            }
+        )
+        chunk_ids.extend(doc["chunks"])
+        chunk_vectors.extend(vecs)
+        emb = np.mean(np.stack(vecs), axis=0)
+        doc_ids.append(doc["doc_id"])
+        doc_vectors.append(emb / max(float(np.linalg.norm(emb)), 1e-12))
+        if sparse_head is not None:
+            weights = [lexical_weights(h) for h in doc["chunks"]]
+            chunk_sparse.extend(weights)
+            doc_sparse.append(max_pool(weights))
+
+    # the old manifest describes the files about to be overwritten; it is rewritten at the end
+    manifest_path = os.path.join(SEARCH_DIR, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
     write_jsonl(os.path.join(SEARCH_DIR, "docs.jsonl"), docs_meta)
-    write_jsonl(os.path.join(SEARCH_DIR, "doc_embeddings.jsonl"), embeddings_rows)
+    # docs without text get no row
+    doc_matrix = np.stack(doc_vectors) if doc_vectors else np.zeros((0, 0), dtype=np.float32)
+    vectors_meta = save_vectors(SEARCH_DIR, DOC_VECTORS, doc_ids, doc_matrix, model=model_id, dtype=vector_dtype)
+    chunk_matrix = np.stack(chunk_vectors) if chunk_vectors else np.zeros((0, 0), dtype=np.float32)
+    save_vectors(SEARCH_DIR, CHUNK_VECTORS, chunk_ids, chunk_matrix, model=model_id)
+    write_jsonl(os.path.join(SEARCH_DIR, CHUNK_INDEX), chunk_index)
+    if sparse_head is not None:
+        save_chunk_weights(SEARCH_DIR, chunk_ids, chunk_sparse)
+        sparse_meta = SparseIndex.build(doc_ids, doc_sparse).save(SEARCH_DIR)
+    else:
+        remove_sparse(SEARCH_DIR)
+        sparse_meta = None
+    write_jsonl(os.path.join(SEARCH_DIR, "paragraph_index.jsonl"), paragraph_index)
+    if paragraph_embs:
+        paragraph_matrix = np.stack(paragraph_embs)
+    else:
+        paragraph_matrix = np.zeros((0, 0))
+    np.save(
+        os.path.join(SEARCH_DIR, "paragraph_embeddings.npy"),
+        np.ascontiguousarray(paragraph_matrix, dtype=np.float32),
+    )
+    # written last: an interrupted build leaves no manifest, so the next one starts from scratch
+    write_json(
+        manifest_path,
+        {
+            "format": MANIFEST_FORMAT,
+            "model": model_id,
+            "docs": manifest_docs,
+            "truncated": {h: n for h, n in sorted(known_cut.items()) if n},
+        },
+    )
 
+    # IVF index over the rows the server ranks (docs with a vector). Snippets only
+    # score the few paragraph rows of a hit, so paragraphs get no index.
+    ann_meta = {"doc": build_and_save(index_path(SEARCH_DIR, "doc"), doc_matrix, n_lists=ann_lists)}
+    stale_ann = index_path(SEARCH_DIR, "paragraph")
+    if os.path.exists(stale_ann):
+        os.remove(stale_ann)
+
+    doc_changes["deleted"] = len(set(previous_docs) - {doc["doc_id"] for doc in manifest_docs})
     write_json(
         os.path.join(SEARCH_DIR, "index_meta.json"),
         {
@@ -175,23 +617,86 @@ def build_index(model_path: str, max_chars: int, batch_size: int) -> None:
             "corpus": os.path.abspath(CORPUS_PATH),
             "embedding": {
                 "model": resolved_model_path,
+                "snapshot": model_id,
                 "method": "BAAI/bge-m3",
-                "max_chars": max_chars,
+                "chunking": chunking,
                 "batch_size": batch_size,
+                "max_tokens": max_tokens,
+                "quantization": quantize,
+                "vectors": vectors_meta,
+                "chunk_vectors": f"{CHUNK_VECTORS}.npy",
+                "chunk_index": CHUNK_INDEX,
+                "sparse": sparse_meta,
+            },
+            "paragraphs": {
+                "source": "corpus.jsonl:paragraphs",
+                "vectors": "paragraph_embeddings.npy",
+                "index": "paragraph_index.jsonl",
             },
-            "counts": {"docs": len(docs_meta)},
+            "ann": ann_meta,
+            "build": {
+                "incremental": incremental,
+                "manifest": MANIFEST_NAME,
+                "docs": doc_changes,
+                "batching": batching,
+                "truncated": truncation,
+                **stats,
+            },
+            "counts": {"docs": len(docs_meta), "chunks": len(chunk_ids), "paragraphs": paragraph_rows},
         },
     )
+    print(
+        f"{len(docs_meta)} docs ({doc_changes['new']} new, {doc_changes['changed']} changed, "
+        f"{doc_changes['deleted']} deleted); chunks {stats['chunks_reused']} reused / "
+        f"{stats['chunks_recomputed']} recomputed; paragraphs {stats['paragraphs_reused']} reused / "
+        f"{stats['paragraphs_recomputed']} recomputed; {time.perf_counter() - t0:.1f}s"
+    )
+    for kind, cut_stats in truncation.items():
+        if cut_stats["texts"]:
+            print(f"warning: {cut_stats['texts']} {kind} truncated at the model window ({cut_stats['tokens']} tokens lost)")
+    if batching["texts"]:
+        print(
+            f"embedded {batching['texts']} texts in {batching['batches']} batches: padding efficiency "
+            f"{batching['padding_efficiency']:.1%} ({batching['padding_efficiency_input_order']:.1%} for fixed "
+            f"batches of {batch_size} in corpus order), {batching['tokens_per_s']:.0f} tokens/s"
+        )
 
 
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("--model-path", default="BAAI/bge-m3")
-    parser.add_argument("--max-chars", type=int, default=4000)
-    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--chunk-tokens", type=int, default=1024, help="tokens per chunk (capped at the model window)")
+    parser.add_argument("--chunk-overlap", type=int, default=128, help="tokens shared by consecutive chunks")
+    parser.add_argument("--max-chars", type=int, default=4000, help="chunk size when no fast tokenizer is available")
+    parser.add_argument("--batch-size", type=int, default=64, help="max texts per forward pass")
+    parser.add_argument(
+        "--max-tokens", type=int, default=16384, help="max padded tokens (texts x longest text) per forward pass"
+    )
+    parser.add_argument(
+        "--quantize",
+        choices=QUANTIZATION_MODES,
+        default="none",
+        help="reduced-precision CPU inference (int8: dynamic quantization of linear layers)",
+    )
+    parser.add_argument("--ann-lists", type=int, default=0, help="IVF lists for doc_ann_ivf.npz (0 = sqrt(docs))")
+    parser.add_argument(
+        "--vector-dtype", choices=DTYPES, default="float32", help="storage type of doc_vectors.npy"
+    )
+    parser.add_argument("--full", action="store_true", help="re-embed everything, ignoring the previous build")
     args = parser.parse_args()
 
-    build_index(args.model_path, args.max_chars, args.batch_size)
+    build_index(
+        args.model_path,
+        args.max_chars,
+        args.batch_size,
+        args.max_tokens,
+        args.quantize,
+        args.ann_lists,
+        args.vector_dtype,
+        incremental=not args.full,
+        chunk_tokens=args.chunk_tokens,
+        chunk_overlap=args.chunk_overlap,
+    )
     print("BGE-M3 search index built")
 
 
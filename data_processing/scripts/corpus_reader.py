@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Random access to corpus.jsonl rows via the doc_id -> byte offset sidecar.
+
+extract_corpus.py writes `corpus_offsets.json` next to `corpus.jsonl`:
+
+  {"corpus": "corpus.jsonl", "size": <bytes>, "mtime_ns": <int>,
+   "docs": {doc_id: [offset, length], ...}}
+
+CorpusReader seeks to a row and parses only that line, so consumers that need
+paragraphs for a handful of docs never load the whole corpus. If the sidecar
+is missing or does not match the corpus size and mtime, offsets are rebuilt by
+scanning the file once; the same happens if a row read at an offset turns out
+to belong to another doc (an edit that kept the file size).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+OFFSETS_NAME = "corpus_offsets.json"
+
+
+def offsets_path_for(corpus_path: str) -> str:
+    return os.path.join(os.path.dirname(corpus_path), OFFSETS_NAME)
+
+
+def write_jsonl_with_offsets(path: str, rows: List[Dict], key: str = "doc_id") -> Dict[str, List[int]]:
+    """Write rows as JSONL and return key -> [byte offset, byte length] per line."""
+    offsets: Dict[str, List[int]] = {}
+    pos = 0
+    with open(path, "wb") as f:
+        for row in rows:
+            line = (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+            f.write(line)
+            offsets[row.get(key)] = [pos, len(line)]
+            pos += len(line)
+    return offsets
+
+
+def write_offsets(corpus_path: str, offsets: Dict[str, List[int]]) -> None:
+    st = os.stat(corpus_path)
+    with open(offsets_path_for(corpus_path), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "corpus": os.path.basename(corpus_path),
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "docs": offsets,
+            },
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+
+
+def scan_offsets(corpus_path: str, key: str = "doc_id") -> Dict[str, List[int]]:
+    offsets: Dict[str, List[int]] = {}
+    pos = 0
+    with open(corpus_path, "rb") as f:
+        for line in f:
+            if line.strip():
+                offsets[json.loads(line).get(key)] = [pos, len(line)]
+            pos += len(line)
+    return offsets
+
+
+class CorpusReader:
+    def __init__(self, corpus_path: str, cache_size: int = 32):
+        self.corpus_path = corpus_path
+        self.cache_size = cache_size
+        self._rows: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.offsets = self._load_offsets()
+
+    def _load_offsets(self) -> Dict[str, Tuple[int, int]]:
+        if not os.path.exists(self.corpus_path):
+            return {}
+        st = os.stat(self.corpus_path)
+        sidecar = offsets_path_for(self.corpus_path)
+        if os.path.exists(sidecar):
+            with open(sidecar, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("size") == st.st_size and data.get("mtime_ns") == st.st_mtime_ns:
+                return {k: (v[0], v[1]) for k, v in data.get("docs", {}).items()}
+        return self._scan_offsets()
+
+    def _scan_offsets(self) -> Dict[str, Tuple[int, int]]:
+        # sidecar missing or stale: one pass over the file, no row is kept
+        return {k: (v[0], v[1]) for k, v in scan_offsets(self.corpus_path).items()}
+
+    def _read_row(self, doc_id: str) -> Dict | None:
+        span = self.offsets.get(doc_id)
+        if span is None:
+            return None
+        offset, length = span
+        with open(self.corpus_path, "rb") as f:
+            f.seek(offset)
+            raw = f.read(length)
+        try:
+            row = json.loads(raw)
+        except ValueError:
+            return None
+        return row if isinstance(row, dict) and row.get("doc_id") == doc_id else None
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.offsets
+
+    def doc_ids(self) -> List[str]:
+        return list(self.offsets)
+
+    def get(self, doc_id: str) -> Dict | None:
+        with self._lock:
+            row = self._rows.get(doc_id)
+            if row is not None:
+                self._rows.move_to_end(doc_id)
+                return row
+        if doc_id not in self.offsets:
+            return None
+        row = self._read_row(doc_id)
+        if row is None:
+            # the offset points at another row: the sidecar no longer matches the corpus
+            self.offsets = self._scan_offsets()
+            row = self._read_row(doc_id)
+            if row is None:
+                return None
+        if self.cache_size > 0:
+            with self._lock:
+                self._rows[doc_id] = row
+                while len(self._rows) > self.cache_size:
+                    self._rows.popitem(last=False)
+        return row
+
+    def paragraphs(self, doc_id: str) -> List[str]:
+        row = self.get(doc_id)
+        if not row:
+            return []
+        return row.get("paragraphs") or []
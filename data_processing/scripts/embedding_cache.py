@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Bounded LRU cache for query embeddings, with optional TTL and hit/miss statistics.
+
+Used by search_server.py (BGE-M3 query vectors) and search_query.py (hashed
+n-gram query vectors). Keys are (model identity, normalized query text), so
+vectors from different models or index settings never mix. A backend that
+ignores more than whitespace and Unicode form (the hash backend lowercases and
+drops stopwords) passes a `fold` function so such variants share one entry.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def normalize_query(text: str) -> str:
+    return unicodedata.normalize("NFC", re.sub(r"\s+", " ", text or "").strip())
+
+
+class EmbeddingCache:
+    def __init__(self, max_size: int = 1024, ttl: float | None = None):
+        self.max_size = max(0, max_size)
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self._data: "OrderedDict[Tuple[str, str], Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_or_compute(
+        self, model_id: str, text: str, compute: Callable[[str], T], fold: Callable[[str], str] | None = None
+    ) -> T:
+        """Return the cached vector for text, or compute(normalized text) and store it.
+
+        fold maps the normalized text to the cache key; texts with the same
+        fold must get the same vector from compute.
+        """
+        norm = normalize_query(text)
+        if self.max_size == 0:
+            return compute(norm)
+        key = (model_id, fold(norm) if fold else norm)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if self.ttl is None or now - stored_at < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value  # type: ignore[return-value]
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+
+        # compute outside the lock so a slow model call does not block cache hits
+        value = compute(norm)
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, float | int | None]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def format_stats(self) -> str:
+        s = self.stats()
+        return (
+            f"query cache: {s['hits']} hits, {s['misses']} misses, {s['evictions']} evictions, "
+            f"{s['expirations']} expired, {s['size']}/{s['max_size']} entries"
+        )
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""Retrieval quality and speed of the search backends, measured on a labelled query set.
+
+Query set: data_processing/eval/search_queries.v<N>.jsonl, one row per query
+  {"id": "q01", "q": "...", "relevant": ["CPal20"], "kind": "known-item" | "topic"}
+The labels are taken from the document titles. Adding or relabelling queries
+means a new file version, so older reports stay comparable.
+
+Per backend, on the rankings from search_query.rank() (answer() without snippets):
+  - recall@k, MRR and nDCG@k (binary gains), mean over queries, plus per-query ranks
+  - query latency p50/p95/p99 over --repeat timed passes. The query cache is
+    cleared before each pass, and an untimed first pass warms the loaders
+  - index/model load time, and the peak Python heap for load + one query pass
+    (tracemalloc, in a separate untimed run; the BGE-M3 model stays loaded
+    between runs and torch tensors are not traced anyway)
+--build first rebuilds the hash index (and with --build-bge the BGE-M3 index,
+from scratch rather than incrementally) twice: once timed, once under
+tracemalloc for the peak heap.
+
+The report is JSON with sorted keys, so reports from two commits diff cleanly:
+  python3 eval_search.py --backends hash,bm25,hash+bm25 --out eval_report.json
+  python3 eval_search.py --out new.json --compare eval_report.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import search_query
+from stage_metrics import quantile
+
+QUERY_SET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "eval", "search_queries.v1.jsonl")
+REPORT_FORMAT = 1
+KS = (1, 5, 10)
+
+
+def read_query_set(path: str) -> Tuple[str, List[Dict]]:
+    """(version, queries); the version is the ".v<N>." part of the file name."""
+    match = re.search(r"\.v(\d+)\.jsonl$", os.path.basename(path))
+    version = f"v{match.group(1)}" if match else "unversioned"
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            if not row.get("relevant"):
+                raise ValueError(f"{path}: query {row.get('id')} has no relevant doc_ids")
+            queries.append(row)
+    return version, queries
+
+
+def file_sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def git_revision() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def query_metrics(ranked: Sequence[str], relevant: Sequence[str], ks: Sequence[int]) -> Dict[str, float]:
+    """recall@k, nDCG@k (binary gains) and reciprocal rank of the first relevant doc."""
+    wanted = set(relevant)
+    hits = [doc_id in wanted for doc_id in ranked]
+    first = next((i for i, hit in enumerate(hits, start=1) if hit), None)
+    out: Dict[str, float] = {"mrr": 1.0 / first if first else 0.0}
+    for k in ks:
+        out[f"recall@{k}"] = sum(hits[:k]) / len(wanted)
+        dcg = sum(1.0 / math.log2(i + 1) for i, hit in enumerate(hits[:k], start=1) if hit)
+        idcg = sum(1.0 / math.log2(i + 1) for i in range(1, min(len(wanted), k) + 1))
+        out[f"ndcg@{k}"] = dcg / idcg
+    return out
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    ordered = sorted(seconds)
+    return {
+        "n": len(ordered),
+        "mean_ms": round(1000 * sum(ordered) / len(ordered), 3) if ordered else 0.0,
+        "p50_ms": round(1000 * quantile(ordered, 0.5), 3),
+        "p95_ms": round(1000 * quantile(ordered, 0.95), 3),
+        "p99_ms": round(1000 * quantile(ordered, 0.99), 3),
+    }
+
+
+def traced(fn: Callable[[], object]) -> Tuple[object, float, int]:
+    """(result, seconds, peak traced bytes) of fn()."""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    try:
+        result = fn()
+        seconds = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def max_rss_mb() -> float | None:
+    """High-water mark of the whole process so far (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def mb(n_bytes: int) -> float:
+    return round(n_bytes / (1024 * 1024), 2)
+
+
+def preload_backend(backend: str, model_path: str) -> None:
+    search_query.preload(backend.split("+"), model_path)
+
+
+def evaluate_backend(
+    backend: str, queries: List[Dict], ks: Sequence[int], repeat: int, model_path: str, ann_probe: int
+) -> Dict:
+    depth = max(ks)
+    search_query.reset_caches()
+    t0 = time.perf_counter()
+    preload_backend(backend, model_path)
+    load_s = time.perf_counter() - t0
+
+    # first pass: warm-up and the rankings that are scored
+    ranked = [
+        [doc_id for doc_id, _ in search_query.rank(q["q"], backend, depth, model_path, ann_probe)] for q in queries
+    ]
+    latencies: List[float] = []
+    for _ in range(repeat):
+        search_query.QUERY_CACHE.clear()
+        for q in queries:
+            t0 = time.perf_counter()
+            search_query.rank(q["q"], backend, depth, model_path, ann_probe)
+            latencies.append(time.perf_counter() - t0)
+
+    per_query = []
+    totals: Dict[str, float] = {}
+    for q, docs in zip(queries, ranked):
+        scores = query_metrics(docs, q["relevant"], ks)
+        for name, value in scores.items():
+            totals[name] = totals.get(name, 0.0) + value
+        first = next((i for i, d in enumerate(docs, start=1) if d in set(q["relevant"])), None)
+        per_query.append({"id": q["id"], "first_relevant_rank": first, "ranked": docs})
+
+    # memory in a separate run, so tracemalloc does not slow the timed passes
+    search_query.reset_caches()
+
+    def load_and_query() -> None:
+        preload_backend(backend, model_path)
+        for q in queries:
+            search_query.rank(q["q"], backend, depth, model_path, ann_probe)
+
+    _, _, peak = traced(load_and_query)
+
+    return {
+        "metrics": {name: round(value / len(queries), 4) for name, value in sorted(totals.items())},
+        "latency": latency_summary(latencies),
+        "load_s": round(load_s, 3),
+        "peak_heap_mb": mb(peak),
+        "max_rss_mb": max_rss_mb(),
+        "queries": per_query,
+    }
+
+
+def measure_build(build: Callable[[], object]) -> Dict:
+    """Wall time of an untraced build, then the peak heap of a second, traced one."""
+    t0 = time.perf_counter()
+    build()
+    seconds = time.perf_counter() - t0
+    _, _, peak = traced(build)
+    return {"seconds": round(seconds, 3), "peak_heap_mb": mb(peak)}
+
+
+def run_builds(build_bge: bool, model_path: str) -> Dict:
+    import build_search_index
+
+    builds: Dict = {"hash": measure_build(build_search_index.build_index)}
+    if build_bge:
+        import build_search_index_bge_m3
+
+        # full builds: an incremental one would reuse every cached vector and time nothing
+        builds["bge-m3"] = measure_build(
+            lambda: build_search_index_bge_m3.build_index(model_path, max_chars=4000, incremental=False)
+        )
+        builds["bge-m3"]["incremental"] = False
+    builds["max_rss_mb"] = max_rss_mb()
+    return builds
+
+
+def index_info(search_dir: str) -> Dict | None:
+    path = os.path.join(search_dir, "index_meta.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return {"generated_on": meta.get("generated_on"), "embedding": meta.get("embedding"), "counts": meta.get("counts")}
+
+
+def compare(old: Dict, new: Dict) -> None:
+    """Print metric and p50/p95 deltas (new - old) per backend present in both reports."""
+    print(f"{old.get('git_revision')} -> {new.get('git_revision')}")
+    if old.get("query_set", {}).get("sha256") != new.get("query_set", {}).get("sha256"):
+        print("  warning: the reports use different query sets")
+    for backend, cur in new["backends"].items():
+        prev = old.get("backends", {}).get(backend)
+        if "metrics" not in cur or not prev or "metrics" not in prev:
+            continue
+        parts = [
+            f"{name} {cur['metrics'][name]:.4f} ({cur['metrics'][name] - prev['metrics'][name]:+.4f})"
+            for name in cur["metrics"]
+            if name in prev["metrics"]
+        ]
+        for name in ("p50_ms", "p95_ms"):
+            parts.append(f"{name} {cur['latency'][name]:.2f} ({cur['latency'][name] - prev['latency'][name]:+.2f})")
+        print(f"  {backend}: " + ", ".join(parts))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", default=QUERY_SET, help="labelled query set (.v<N>.jsonl)")
+    parser.add_argument("--backends", default=",".join(search_query.BACKENDS))
+    parser.add_argument("--ks", default=",".join(str(k) for k in KS), help="cutoffs for recall@k and nDCG@k")
+    parser.add_argument("--repeat", type=int, default=5, help="timed passes over the query set")
+    parser.add_argument("--model-path", default="BAAI/bge-m3")
+    parser.add_argument("--ann-probe", type=int, default=0)
+    parser.add_argument("--build", action="store_true", help="rebuild the hash index first and measure it")
+    parser.add_argument("--build-bge", action="store_true", help="with --build, also rebuild the BGE-M3 index")
+    parser.add_argument("--out", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", help="earlier report to print deltas against")
+    args = parser.parse_args()
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    unknown = [b for b in backends if b not in search_query.BACKENDS]
+    if unknown:
+        raise SystemExit(f"Unknown backend(s): {', '.join(unknown)} (expected {', '.join(search_query.BACKENDS)})")
+    ks = sorted({int(k) for k in args.ks.split(",") if k.strip()})
+    version, queries = read_query_set(args.queries)
+
+    report: Dict = {
+        "format": REPORT_FORMAT,
+        "generated_on": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "query_set": {
+            "file": os.path.basename(args.queries),
+            "version": version,
+            "sha256": file_sha256(args.queries),
+            "queries": len(queries),
+        },
+        "settings": {
+            "ks": ks,
+            "repeat": args.repeat,
+            "ann_probe": args.ann_probe,
+            "model_path": args.model_path,
+            "expansion": {"top_k": search_query.TOP_K, "min_sim": search_query.MIN_SIM},
+        },
+    }
+    if args.build:
+        report["builds"] = run_builds(args.build_bge, args.model_path)
+    report["indexes"] = {
+        "hash": index_info(search_query.SEARCH_DIR),
+        "bge-m3": index_info(search_query.SEARCH_DIR_BGE),
+    }
+
+    report["backends"] = {}
+    for backend in backends:
+        try:
+            result = evaluate_backend(backend, queries, ks, args.repeat, args.model_path, args.ann_probe)
+        except (SystemExit, FileNotFoundError) as exc:
+            # missing index or missing torch/transformers: keep going with the other backends
+            report["backends"][backend] = {"skipped": str(exc)}
+            print(f"{backend}: skipped ({exc})", file=sys.stderr)
+            continue
+        report["backends"][backend] = result
+        metrics = ", ".join(f"{k} {v:.3f}" for k, v in result["metrics"].items())
+        print(
+            f"{backend}: {metrics}; p50 {result['latency']['p50_ms']:.2f} ms, "
+            f"p95 {result['latency']['p95_ms']:.2f} ms, load {result['load_s']:.2f}s",
+            file=sys.stderr,
+        )
+
+    text = json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,8 @@ from datetime import datetime, timezone
 from typing import Dict, List, Iterable, Tuple
 import xml.etree.ElementTree as ET
 
+from corpus_reader import write_jsonl_with_offsets, write_offsets
+
 TEI_NS = "http://www.tei-c.org/ns/1.0"
 XML_NS = "http://www.w3.org/XML/1998/namespace"
 NS = {"tei": TEI_NS}
@@ -382,12 +384,6 @@ def write_json(path: str, data: Dict) -> None:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
 
-def write_jsonl(path: str, rows: List[Dict]) -> None:
-    with open(path, "w", encoding="utf-8") as f:
-        for row in rows:
-            f.write(json.dumps(row, ensure_ascii=False) + "\n")
-
-
 def main() -> None:
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
@@ -399,7 +395,9 @@ def main() -> None:
     write_json(os.path.join(OUTPUT_DIR, "register.json"), register)
 
     corpus = build_corpus(doc_files)
-    write_jsonl(os.path.join(OUTPUT_DIR, "corpus.jsonl"), corpus)
+    corpus_path = os.path.join(OUTPUT_DIR, "corpus.jsonl")
+    # byte offsets per doc_id so readers can seek to single rows
+    write_offsets(corpus_path, write_jsonl_with_offsets(corpus_path, corpus))
 
     print(f"Docs: {len(doc_files)}")
     print(f"Register sections: {len(register.get('registerData', {}))}")
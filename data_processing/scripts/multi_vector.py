@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Multi-vector doc retrieval over the chunk vectors of the BGE-M3 index.
+
+build_search_index_bge_m3.py keeps every chunk vector (chunk_vectors.npy, one
+row per chunk, docs in corpus order) and chunk_index.jsonl with each doc's row
+range. Instead of the mean doc vector, a doc scores by its best chunk
+(top_m = 1) or by the mean of its top_m chunk similarities. One matching
+section of a long, multi-topic doc is then not averaged away.
+
+A query costs one mat-vec over all chunks plus one reduction over the doc
+segments: np.maximum.reduceat for the max, a padded (docs x longest doc) gather
+for top_m > 1.
+
+  python3 multi_vector.py --index-dir ../output/search_index_bge_m3 --top-m 1,2,4
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from vector_store import exists as vectors_exist
+from vector_store import load as load_vectors
+
+CHUNK_VECTORS = "chunk_vectors"
+CHUNK_INDEX = "chunk_index.jsonl"
+
+
+def exists(index_dir: str) -> bool:
+    return vectors_exist(index_dir, CHUNK_VECTORS) and os.path.exists(os.path.join(index_dir, CHUNK_INDEX))
+
+
+class ChunkIndex:
+    def __init__(self, doc_ids: List[str], starts: np.ndarray, counts: np.ndarray, matrix: np.ndarray):
+        if counts.size and (counts.min() <= 0 or starts[0] != 0 or np.any(starts[1:] != np.cumsum(counts)[:-1])):
+            raise ValueError("chunk rows must be contiguous per doc, in doc order, without gaps")
+        if int(counts.sum()) != matrix.shape[0]:
+            raise ValueError(f"chunk index covers {int(counts.sum())} rows, the matrix has {matrix.shape[0]}")
+        self.doc_ids = doc_ids
+        self.starts = starts.astype(np.int64)
+        self.counts = counts.astype(np.int64)
+        self.matrix = matrix
+        self._slots: np.ndarray | None = None
+
+    @classmethod
+    def load(cls, index_dir: str) -> "ChunkIndex":
+        _, matrix, _ = load_vectors(index_dir, CHUNK_VECTORS)
+        doc_ids: List[str] = []
+        starts: List[int] = []
+        counts: List[int] = []
+        with open(os.path.join(index_dir, CHUNK_INDEX), "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                row = json.loads(line)
+                doc_ids.append(row["doc_id"])
+                starts.append(row["start"])
+                counts.append(row["count"])
+        return cls(doc_ids, np.asarray(starts, dtype=np.int64), np.asarray(counts, dtype=np.int64), matrix)
+
+    def _padded_slots(self) -> np.ndarray:
+        """(docs, longest doc) chunk rows, padded with -1."""
+        if self._slots is None:
+            width = int(self.counts.max()) if self.counts.size else 0
+            offsets = np.arange(width, dtype=np.int64)
+            slots = self.starts[:, None] + offsets[None, :]
+            self._slots = np.where(offsets[None, :] < self.counts[:, None], slots, -1)
+        return self._slots
+
+    def doc_scores(self, qvecs: np.ndarray, top_m: int = 1) -> np.ndarray:
+        """Score of every doc for one query (dim,) or many (queries, dim): max or top_m mean of chunk sims."""
+        if not self.doc_ids:
+            return np.zeros(qvecs.shape[:-1] + (0,), dtype=np.float32)
+        sims = qvecs @ self.matrix.T
+        if top_m <= 1:
+            return np.maximum.reduceat(sims, self.starts, axis=-1)
+        slots = self._padded_slots()
+        m = min(top_m, slots.shape[1])
+        vals = np.where(slots >= 0, sims[..., np.maximum(slots, 0)], -np.inf)
+        best = -np.partition(-vals, m - 1, axis=-1)[..., :m]
+        # docs with fewer than m chunks average over the chunks they have
+        total = np.where(np.isfinite(best), best, 0.0).sum(axis=-1)
+        return (total / np.minimum(self.counts, m)).astype(np.float32)
+
+    def search(self, qvec: np.ndarray, top: int, top_m: int = 1) -> List[Tuple[str, float]]:
+        """Best docs for one query, best first (ties in doc order)."""
+        scores = self.doc_scores(qvec, top_m)
+        if top <= 0 or scores.shape[0] == 0:
+            return []
+        if top < scores.shape[0]:
+            part = np.argpartition(-scores, top - 1)[:top]
+        else:
+            part = np.arange(scores.shape[0])
+        order = part[np.lexsort((part, -scores[part]))]
+        return [(self.doc_ids[i], float(scores[i])) for i in order]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index-dir", required=True, help="BGE-M3 index with chunk_vectors.npy")
+    parser.add_argument("--top-m", default="1,2,4", help="chunks averaged per doc (1 = max)")
+    parser.add_argument("--queries", type=int, default=200, help="random chunk vectors used as queries")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    index = ChunkIndex.load(args.index_dir)
+    load_ms = (time.perf_counter() - t0) * 1000
+    print(f"{len(index.doc_ids)} docs, {index.matrix.shape[0]} chunks; load {load_ms:.1f} ms")
+    rng = np.random.default_rng(0)
+    queries = np.asarray(index.matrix[rng.integers(0, index.matrix.shape[0], args.queries)])
+    for m in [int(x) for x in args.top_m.split(",") if x.strip()]:
+        t0 = time.perf_counter()
+        for q in queries:
+            index.search(q, 10, m)
+        per_query = (time.perf_counter() - t0) * 1000 / max(1, len(queries))
+        t0 = time.perf_counter()
+        index.doc_scores(queries, m)
+        batched = (time.perf_counter() - t0) * 1000 / max(1, len(queries))
+        print(f"  top_m={m}: {per_query:.3f} ms/query, {batched:.3f} ms/query batched")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Hashed char n-gram features, shared by build_search_index.py and search_query.py.
+
+A token contributes the n-grams (ngram_min..ngram_max) of "<token>" plus the
+token itself. Each feature is hashed to a (bucket, sign) pair; the token
+vector is the signed bucket counts. Hash schemes:
+  - crc32: zlib.crc32, bucket = hash % dim, sign from the top bit (default)
+  - md5:   first 4 digest bytes % dim, sign from byte 5 (indexes built before
+           the scheme was recorded in index_meta.json)
+
+Indexes built with different schemes (or dim / n-gram range) are not
+comparable; index_meta.json records all of them under "embedding".
+"""
+
+from __future__ import annotations
+
+import hashlib
+import zlib
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+DEFAULT_SCHEME = "crc32"
+LEGACY_SCHEME = "md5"
+
+
+def hash_md5(feature: str, dim: int) -> Tuple[int, int]:
+    digest = hashlib.md5(feature.encode("utf-8")).digest()
+    idx = int.from_bytes(digest[:4], "little") % dim
+    sign = 1 if digest[4] % 2 == 0 else -1
+    return idx, sign
+
+
+def hash_crc32(feature: str, dim: int) -> Tuple[int, int]:
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % dim, (1 if h < 0x80000000 else -1)
+
+
+HASH_SCHEMES: Dict[str, Callable[[str, int], Tuple[int, int]]] = {
+    "crc32": hash_crc32,
+    "md5": hash_md5,
+}
+
+
+class FeatureHasher:
+    """Token -> sparse/dense hashed n-gram vectors.
+
+    Every distinct n-gram is interned once and hashed once; token_matrix()
+    then builds all token rows with a single NumPy bincount.
+    """
+
+    def __init__(self, dim: int, ngram_min: int, ngram_max: int, scheme: str = DEFAULT_SCHEME):
+        if scheme not in HASH_SCHEMES:
+            raise ValueError(f"Unknown hash scheme '{scheme}' (expected one of {', '.join(HASH_SCHEMES)})")
+        self.dim = dim
+        self.ngram_min = ngram_min
+        self.ngram_max = ngram_max
+        self.scheme = scheme
+        self._hash = HASH_SCHEMES[scheme]
+        self._ids: Dict[str, int] = {}
+        self._buckets: List[int] = []
+        self._signs: List[int] = []
+
+    def _hash_new(self) -> None:
+        """Hash the features interned since the last call."""
+        for feat in list(self._ids)[len(self._buckets) :]:
+            idx, sign = self._hash(feat, self.dim)
+            self._buckets.append(idx)
+            self._signs.append(sign)
+
+    def features(self, token: str) -> List[str]:
+        token = token.lower()
+        t = f"<{token}>"
+        feats = [t[i : i + n] for n in range(self.ngram_min, self.ngram_max + 1) for i in range(len(t) - n + 1)]
+        feats.append(token)
+        return feats
+
+    def feature_id(self, feature: str) -> int:
+        i = self._ids.get(feature)
+        if i is None:
+            i = self._ids[feature] = len(self._buckets)
+            idx, sign = self._hash(feature, self.dim)
+            self._buckets.append(idx)
+            self._signs.append(sign)
+        return i
+
+    def token_sparse(self, token: str) -> List[Tuple[int, float]]:
+        out: Dict[int, float] = {}
+        for feat in self.features(token):
+            i = self.feature_id(feat)
+            idx = self._buckets[i]
+            out[idx] = out.get(idx, 0.0) + float(self._signs[i])
+        return list(out.items())
+
+    def token_matrix(self, tokens: List[str]) -> np.ndarray:
+        """Unnormalized (len(tokens), dim) float64 matrix of signed bucket counts."""
+        intern = self._ids.setdefault
+        ids: List[int] = []
+        lengths: List[int] = []
+        for token in tokens:
+            feats = self.features(token)
+            ids.extend([intern(f, len(self._ids)) for f in feats])
+            lengths.append(len(feats))
+        self._hash_new()
+        feat_ids = np.asarray(ids, dtype=np.int64)
+        rows = np.repeat(np.arange(len(tokens), dtype=np.int64), lengths)
+        flat = rows * self.dim + np.asarray(self._buckets, dtype=np.int64)[feat_ids]
+        weights = np.asarray(self._signs, dtype=np.float64)[feat_ids]
+        counts = np.bincount(flat, weights=weights, minlength=len(tokens) * self.dim)
+        return counts.reshape(len(tokens), self.dim)
+
+
+def normalize_rows(mat: np.ndarray) -> np.ndarray:
+    """L2-normalize rows; all-zero rows stay zero."""
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
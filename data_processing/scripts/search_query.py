@@ -3,6 +3,11 @@
 
 Usage:
   python3 search_query.py "your query" --top 10
+
+Persistent mode (indexes, corpus offsets and the BGE-M3 model are loaded once):
+  python3 search_query.py --repl                        # one query per stdin line
+  python3 search_query.py --daemon /tmp/aco-search.sock # JSON lines over a unix socket
+  python3 search_query.py --connect /tmp/aco-search.sock "your query" --backend bge-m3
 """
 
 from __future__ import annotations
@@ -10,14 +15,33 @@ from __future__ import annotations
 import json
 import os
 import re
+import socket
+import socketserver
 import sys
-import hashlib
+import time
 from typing import Dict, Iterable, List, Tuple
 
+import numpy as np
+
+from ann_index import IVFIndex, index_path, load_for
+from bm25_index import RRF_DEPTH, BM25Index, best_paragraph as best_paragraph_lexical, query_terms, rrf
+from bm25_index import exists as bm25_exists
+from corpus_reader import CorpusReader
+from embedding_cache import EmbeddingCache
+from multi_vector import ChunkIndex
+from multi_vector import exists as chunk_index_exists
+from ngram_hash import HASH_SCHEMES, LEGACY_SCHEME, FeatureHasher
+from vector_store import has_doc_vectors, load_doc_vectors
+
 OUTPUT_DIR = "/Users/TH_1/Documents/Repo/ACO/data_processing/output"
 SEARCH_DIR = os.path.join(OUTPUT_DIR, "search_index")
 SEARCH_DIR_BGE = os.path.join(OUTPUT_DIR, "search_index_bge_m3")
 
+# "<dense>+bm25" fuses the dense ranking with BM25 by reciprocal rank;
+# "bge-m3-chunks" scores docs by their best chunk vectors instead of the mean doc vector
+BACKENDS = ("hash", "bge-m3", "bge-m3-chunks", "bm25", "hash+bm25", "bge-m3+bm25")
+CHUNK_TOP_M = 1  # chunks averaged per doc for bge-m3-chunks (1 = max-sim); --chunk-top-m
+
 
 def resolve_model_path(model_path: str) -> str:
     # If given a HF cache root, resolve to the latest snapshot path
@@ -65,27 +89,38 @@ def tokenize(text: str) -> List[str]:
     return [t.lower() for t in TOKEN_RE.findall(text or "")]
 
 
-def hash_to_index(token: str, dim: int) -> Tuple[int, int]:
-    digest = hashlib.md5(token.encode("utf-8")).digest()
-    idx = int.from_bytes(digest[:4], "little") % dim
-    sign = 1 if digest[4] % 2 == 0 else -1
-    return idx, sign
+# n-gram hasher matching the index at SEARCH_DIR, see load_hasher()
+_HASHER: FeatureHasher | None = None
+
+
+def load_hasher() -> FeatureHasher:
+    """Hasher for the scheme recorded in index_meta.json; refuses indexes built with other settings."""
+    global _HASHER
+    if _HASHER is not None:
+        return _HASHER
+    meta_path = os.path.join(SEARCH_DIR, "index_meta.json")
+    embedding: Dict = {}
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            embedding = json.load(f).get("embedding", {})
+    # indexes written before the scheme was recorded used md5
+    scheme = embedding.get("hash", LEGACY_SCHEME)
+    if scheme not in HASH_SCHEMES:
+        raise SystemExit(
+            f"{SEARCH_DIR} was built with n-gram hash '{scheme}', which this version of search_query.py "
+            f"does not support ({', '.join(HASH_SCHEMES)}). Rebuild the index with build_search_index.py."
+        )
+    expected = {"dim": DIM, "ngram_min": NGRAM_MIN, "ngram_max": NGRAM_MAX}
+    mismatch = [f"{k}={embedding[k]} (expected {v})" for k, v in expected.items() if k in embedding and embedding[k] != v]
+    if mismatch:
+        raise SystemExit(f"{SEARCH_DIR} is incompatible with search_query.py: {', '.join(mismatch)}")
+    _HASHER = FeatureHasher(DIM, NGRAM_MIN, NGRAM_MAX, scheme)
+    return _HASHER
 
 
 def token_vector_sparse(token: str) -> List[Tuple[int, float]]:
-    token = token.lower()
-    t = f"<{token}>"
-    feats: Dict[int, float] = {}
-    for n in range(NGRAM_MIN, NGRAM_MAX + 1):
-        if len(t) < n:
-            continue
-        for i in range(len(t) - n + 1):
-            ngram = t[i : i + n]
-            idx, sign = hash_to_index(ngram, DIM)
-            feats[idx] = feats.get(idx, 0.0) + float(sign)
-    idx, sign = hash_to_index(token, DIM)
-    feats[idx] = feats.get(idx, 0.0) + float(sign)
-    return list(feats.items())
+    return load_hasher().token_sparse(token)
+
 
 def embed_token(token: str) -> List[float]:
     vec = [0.0] * DIM
@@ -101,10 +136,29 @@ def l2_normalize(vec: List[float]) -> List[float]:
     return [v / norm for v in vec]
 
 
+# Query vectors keyed by (index settings, the query's embedded tokens)
+QUERY_CACHE = EmbeddingCache(max_size=256)
+
+
+def hash_model_id() -> str:
+    return f"char_ngram_hash:{load_hasher().scheme}:{DIM}:{NGRAM_MIN}-{NGRAM_MAX}"
+
+
+def embedded_tokens(text: str) -> List[str]:
+    """The tokens a hash query vector is built from (lowercased, no stopwords)."""
+    return [t for t in tokenize(text) if len(t) >= 2 and t not in STOPWORDS]
+
+
 def embed_text(text: str) -> List[float]:
+    # "Foo" and "foo", or queries differing only in stopwords, share one cache entry
+    return QUERY_CACHE.get_or_compute(
+        hash_model_id(), text, embed_text_uncached, fold=lambda norm: " ".join(embedded_tokens(norm))
+    )
+
+
+def embed_text_uncached(text: str) -> List[float]:
     vec = [0.0] * DIM
-    tokens = [t for t in tokenize(text) if len(t) >= 2 and t not in STOPWORDS]
-    for tok in tokens:
+    for tok in embedded_tokens(text):
         for idx, val in token_vector_sparse(tok):
             vec[idx] += val
     return l2_normalize(vec)
@@ -123,17 +177,95 @@ def read_jsonl(path: str) -> Iterable[Dict]:
             yield json.loads(line)
 
 
-def load_corpus_paragraphs() -> Dict[str, List[str]]:
-    corpus_path = os.path.join(OUTPUT_DIR, "corpus.jsonl")
-    mapping: Dict[str, List[str]] = {}
-    if not os.path.exists(corpus_path):
-        return mapping
-    for row in read_jsonl(corpus_path):
-        doc_id = row.get("doc_id")
-        paras = row.get("paragraphs") or []
-        if doc_id and paras:
-            mapping[doc_id] = paras
-    return mapping
+# Everything read from disk is kept for the life of the process, so the
+# REPL/daemon pays for it once; reset_caches() forgets it after a rebuild.
+_CORPUS: CorpusReader | None = None
+_DOC_MATRICES: Dict[str, Tuple[List[str], np.ndarray]] = {}
+_DOC_ANN: Dict[str, IVFIndex | None] = {}
+_PARAGRAPH_INDEXES: Dict[str, Tuple[Dict[str, Tuple[int, int]], np.ndarray | None]] = {}
+_BGE_MODELS: Dict[str, Tuple] = {}
+_BM25: BM25Index | None = None
+_CHUNK_INDEX: ChunkIndex | None = None
+
+
+def reset_caches() -> None:
+    global _CORPUS, _VOCAB, _VOCAB_KNN, _HASHER, _BM25, _CHUNK_INDEX
+    _CORPUS = None
+    _BM25 = None
+    _CHUNK_INDEX = None
+    _HASHER = None
+    _VOCAB = None
+    _VOCAB_KNN = None
+    _DOC_MATRICES.clear()
+    _DOC_ANN.clear()
+    _PARAGRAPH_INDEXES.clear()
+    QUERY_CACHE.clear()
+
+
+def load_corpus() -> CorpusReader:
+    global _CORPUS
+    if _CORPUS is None:
+        _CORPUS = CorpusReader(os.path.join(OUTPUT_DIR, "corpus.jsonl"))
+    return _CORPUS
+
+
+def load_doc_matrix(search_dir: str) -> Tuple[List[str], np.ndarray]:
+    if search_dir not in _DOC_MATRICES:
+        _DOC_MATRICES[search_dir] = load_doc_vectors(search_dir)
+    return _DOC_MATRICES[search_dir]
+
+
+def rank_docs(search_dir: str, qvec: List[float], top: int, ann_probe: int = 0) -> List[Tuple[str, float]]:
+    """Top docs by dot product; with ann_probe > 0 only the closest IVF lists are scanned."""
+    doc_ids, matrix = load_doc_matrix(search_dir)
+    if not doc_ids:
+        return []
+    q = np.asarray(qvec, dtype=np.float32)
+    ann = None
+    if ann_probe:
+        if search_dir not in _DOC_ANN:
+            _DOC_ANN[search_dir] = load_for(index_path(search_dir, "doc"), matrix)
+        ann = _DOC_ANN[search_dir]
+    if ann is not None:
+        rows, scores = ann.search(matrix, q, top, ann_probe)
+    else:
+        scores = matrix @ q
+        rows = np.argsort(-scores, kind="stable")[:top]
+        scores = scores[rows]
+    return [(doc_ids[i], float(s)) for i, s in zip(rows, scores)]
+
+
+def load_chunk_index() -> ChunkIndex:
+    global _CHUNK_INDEX
+    if _CHUNK_INDEX is None:
+        if not chunk_index_exists(SEARCH_DIR_BGE):
+            raise SystemExit(f"No chunk vectors in {SEARCH_DIR_BGE}; rebuild it with build_search_index_bge_m3.py")
+        _CHUNK_INDEX = ChunkIndex.load(SEARCH_DIR_BGE)
+    return _CHUNK_INDEX
+
+
+def rank_chunks(qvec: List[float], top: int, chunk_top_m: int = CHUNK_TOP_M) -> List[Tuple[str, float]]:
+    """Top docs by the max (or top-chunk_top_m mean) similarity of their chunks."""
+    return load_chunk_index().search(np.asarray(qvec, dtype=np.float32), top, chunk_top_m)
+
+
+def load_paragraph_index(search_dir: str) -> Tuple[Dict[str, Tuple[int, int]], np.ndarray | None]:
+    if search_dir in _PARAGRAPH_INDEXES:
+        return _PARAGRAPH_INDEXES[search_dir]
+    ranges_path = os.path.join(search_dir, "paragraph_index.jsonl")
+    matrix_path = os.path.join(search_dir, "paragraph_embeddings.npy")
+    if not (os.path.exists(ranges_path) and os.path.exists(matrix_path)):
+        loaded = ({}, None)
+    else:
+        ranges = {row["doc_id"]: (row["start"], row["count"]) for row in read_jsonl(ranges_path)}
+        loaded = (ranges, np.load(matrix_path, mmap_mode="r"))
+    _PARAGRAPH_INDEXES[search_dir] = loaded
+    return loaded
+
+
+# Vocab matrix and neighbour table, loaded once per process
+_VOCAB: Tuple[List[str], np.ndarray, Dict[str, int]] | None = None
+_VOCAB_KNN: Dict | None = None
 
 
 def load_vocab() -> Tuple[List[str], List[List[float]]]:
@@ -145,26 +277,87 @@ def load_vocab() -> Tuple[List[str], List[List[float]]]:
     return tokens, vectors
 
 
-def expand_query(query: str, top_k: int = TOP_K, min_sim: float = MIN_SIM) -> Dict[str, List[Tuple[str, float]]]:
-    tokens, vectors = load_vocab()
-    expansions: Dict[str, List[Tuple[str, float]]] = {}
-
-    for qtok in [t for t in tokenize(query) if len(t) >= 2 and t not in STOPWORDS]:
-        qvec = embed_token(qtok)
-        scored = []
-        for tok, vec in zip(tokens, vectors):
-            if tok == qtok:
-                continue
-            sim = dot(qvec, vec)
-            if sim >= min_sim:
-                scored.append((tok, sim))
-        scored.sort(key=lambda x: x[1], reverse=True)
-        expansions[qtok] = scored[:top_k]
+def load_vocab_matrix() -> Tuple[List[str], np.ndarray, Dict[str, int]]:
+    """Vocab tokens, their float32 vectors (one row each) and token -> row."""
+    global _VOCAB
+    if _VOCAB is not None:
+        return _VOCAB
+    matrix_path = os.path.join(SEARCH_DIR, "vocab_vectors.npy")
+    tokens_path = os.path.join(SEARCH_DIR, "vocab_tokens.json")
+    if os.path.exists(matrix_path) and os.path.exists(tokens_path):
+        with open(tokens_path, "r", encoding="utf-8") as f:
+            tokens = json.load(f)["tokens"]
+        matrix = np.load(matrix_path)
+    else:
+        # index built before vocab_vectors.npy existed
+        tokens, vectors = load_vocab()
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(tokens), DIM)
+    _VOCAB = (tokens, matrix, {t: i for i, t in enumerate(tokens)})
+    return _VOCAB
+
+
+def load_vocab_knn() -> Dict:
+    """Precomputed vocab neighbours (vocab_knn.npz); empty dict if the index has none."""
+    global _VOCAB_KNN
+    if _VOCAB_KNN is None:
+        path = os.path.join(SEARCH_DIR, "vocab_knn.npz")
+        _VOCAB_KNN = {}
+        if os.path.exists(path):
+            with np.load(path) as data:
+                _VOCAB_KNN = {
+                    "indices": data["indices"],
+                    "sims": data["sims"],
+                    "k": int(data["k"]),
+                    "min_sim": float(data["min_sim"]),
+                }
+    return _VOCAB_KNN
 
-    return expansions
 
+def expand_query(query: str, top_k: int = TOP_K, min_sim: float = MIN_SIM) -> Dict[str, List[Tuple[str, float]]]:
+    tokens, matrix, token_row = load_vocab_matrix()
+    knn = load_vocab_knn()
+    expansions: Dict[str, List[Tuple[str, float]]] = {}
 
-def search(query: str, top: int = 10, expand: bool = True) -> List[Tuple[str, float]]:
+    qtoks = list(dict.fromkeys(t for t in tokenize(query) if len(t) >= 2 and t not in STOPWORDS))
+    # the table answers vocab tokens as long as it holds at least top_k neighbours down to min_sim
+    use_table = bool(knn) and top_k <= knn["k"] and min_sim >= knn["min_sim"]
+    live = []
+    for qtok in qtoks:
+        row = token_row.get(qtok)
+        if use_table and row is not None:
+            keep = (knn["indices"][row] >= 0) & (knn["sims"][row] >= min_sim)
+            expansions[qtok] = [
+                (tokens[i], float(sim)) for i, sim in zip(knn["indices"][row][keep][:top_k], knn["sims"][row][keep])
+            ]
+        else:
+            live.append(qtok)
+    if not live:
+        return {qtok: expansions[qtok] for qtok in qtoks}
+
+    # vocab tokens score with their stored row, as the table was built from those
+    qmat = np.asarray(
+        [matrix[token_row[t]] if t in token_row else embed_token(t) for t in live], dtype=np.float32
+    ).reshape(len(live), DIM)
+    sims = qmat @ matrix.T
+
+    for qtok, row in zip(live, sims):
+        self_row = token_row.get(qtok)
+        if self_row is not None:
+            row[self_row] = -np.inf
+        cand = np.flatnonzero(row >= min_sim)
+        # stable sort keeps vocab order among equal scores
+        best = cand[np.argsort(-row[cand], kind="stable")][:top_k]
+        expansions[qtok] = [(tokens[i], float(row[i])) for i in best]
+
+    return {qtok: expansions[qtok] for qtok in qtoks}
+
+
+def search(query: str, top: int = 10, expand: bool = True, ann_probe: int = 0) -> List[Tuple[str, float]]:
+    return rank_docs(SEARCH_DIR, query_vector(query, expand), top, ann_probe)
+
+
+def query_vector(query: str, expand: bool = True) -> List[float]:
+    """Hash query vector, with expansion tokens mixed in at half weight."""
     qvec = embed_text(query)
 
     if expand:
@@ -178,29 +371,31 @@ def search(query: str, top: int = 10, expand: bool = True) -> List[Tuple[str, fl
                     exp_vec[idx] += val
             exp_vec = l2_normalize(exp_vec)
             qvec = l2_normalize([q + 0.5 * e for q, e in zip(qvec, exp_vec)])
-
-    results = []
-    for row in read_jsonl(os.path.join(SEARCH_DIR, "doc_embeddings.jsonl")):
-        doc_id = row["doc_id"]
-        sim = dot(qvec, row["vector"])
-        results.append((doc_id, sim))
-    results.sort(key=lambda x: x[1], reverse=True)
-    return results[:top]
+    return qvec
 
 
 def attach_best_paragraph_hash(query: str, results: List[Tuple[str, float]]) -> List[Tuple[str, float, str | None]]:
-    paragraphs = load_corpus_paragraphs()
+    corpus = load_corpus()
     qvec = embed_text(query)
+    para_ranges, para_matrix = load_paragraph_index(SEARCH_DIR)
+    qarr = np.asarray(qvec, dtype=np.float32)
     final = []
     for doc_id, sim in results:
-        paras = paragraphs.get(doc_id, [])
+        paras = corpus.paragraphs(doc_id)
         if not paras:
             final.append((doc_id, sim, None))
             continue
+        span = para_ranges.get(doc_id)
+        if span is not None and span[1] == len(paras):
+            start, count = span
+            scores = para_matrix[start : start + count] @ qarr
+            final.append((doc_id, sim, paras[int(np.argmax(scores))]))
+            continue
+        # no (or stale) paragraph index for this doc: embed paragraphs live
         best_text = None
         best_score = -1.0
         for text in paras:
-            pvec = embed_text(text)
+            pvec = embed_text_uncached(text)
             score = dot(qvec, pvec)
             if score > best_score:
                 best_score = score
@@ -209,12 +404,10 @@ def attach_best_paragraph_hash(query: str, results: List[Tuple[str, float]]) ->
     return final
 
 
-def search_bge_m3(
-    query: str,
-    top: int = 10,
-    model_path: str = "BAAI/bge-m3",
-    with_paragraphs: bool = False,
-) -> List[Tuple[str, float, str | None]]:
+def load_bge_m3(model_path: str) -> Tuple:
+    """(tokenizer, model, device) for model_path, loaded on first use."""
+    if model_path in _BGE_MODELS:
+        return _BGE_MODELS[model_path]
     try:
         from transformers import AutoTokenizer, AutoModel
         import torch
@@ -228,54 +421,69 @@ def search_bge_m3(
     tokenizer = AutoTokenizer.from_pretrained(resolved_model_path, use_fast=False)
     model = AutoModel.from_pretrained(resolved_model_path).to(device)
     model.eval()
+    _BGE_MODELS[model_path] = (tokenizer, model, device)
+    return _BGE_MODELS[model_path]
 
-    enc = tokenizer([query], padding=True, truncation=True, return_tensors="pt")
+
+def encode_bge_m3(texts: List[str], tokenizer, model, device: str, max_length: int | None = None) -> List[List[float]]:
+    import torch
+
+    enc = tokenizer(texts, padding=True, truncation=True, return_tensors="pt", max_length=max_length)
     enc = {k: v.to(device) for k, v in enc.items()}
     with torch.no_grad():
         out = model(**enc)
         mask = enc["attention_mask"].unsqueeze(-1).expand(out.last_hidden_state.size()).float()
         pooled = (out.last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
         pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
-    qvec = pooled[0].cpu().tolist()
+    return pooled.cpu().tolist()
 
-    results = []
-    for row in read_jsonl(os.path.join(SEARCH_DIR_BGE, "doc_embeddings.jsonl")):
-        doc_id = row["doc_id"]
-        vec = row.get("vector") or []
-        if not vec:
-            continue
-        sim = dot(qvec, vec)
-        results.append((doc_id, sim))
-    results.sort(key=lambda x: x[1], reverse=True)
+
+def search_bge_m3(
+    query: str,
+    top: int = 10,
+    model_path: str = "BAAI/bge-m3",
+    with_paragraphs: bool = False,
+    ann_probe: int = 0,
+) -> List[Tuple[str, float, str | None]]:
+    qvec = embed_bge_m3_query(query, model_path)
+    results = rank_docs(SEARCH_DIR_BGE, qvec, top, ann_probe)
     if not with_paragraphs:
-        return [(doc_id, sim, None) for doc_id, sim in results[:top]]
+        return [(doc_id, sim, None) for doc_id, sim in results]
+    return attach_best_paragraph_bge_m3(qvec, results, model_path)
+
+
+def embed_bge_m3_query(query: str, model_path: str) -> List[float]:
+    tokenizer, model, device = load_bge_m3(model_path)
+    return encode_bge_m3([query], tokenizer, model, device)[0]
+
 
-    paragraphs = load_corpus_paragraphs()
+def attach_best_paragraph_bge_m3(
+    qvec: List[float], results: List[Tuple[str, float]], model_path: str
+) -> List[Tuple[str, float, str | None]]:
+    corpus = load_corpus()
+    para_ranges, para_matrix = load_paragraph_index(SEARCH_DIR_BGE)
+    qarr = np.asarray(qvec, dtype=np.float32)
     final = []
-    for doc_id, sim in results[:top]:
-        paras = paragraphs.get(doc_id, [])
+    for doc_id, sim in results:
+        paras = corpus.paragraphs(doc_id)
         if not paras:
             final.append((doc_id, sim, None))
             continue
+        span = para_ranges.get(doc_id)
+        if span is not None and span[1] == len(paras):
+            start, count = span
+            scores = para_matrix[start : start + count] @ qarr
+            final.append((doc_id, sim, paras[int(np.argmax(scores))]))
+            continue
+        # no (or stale) paragraph index for this doc: embed paragraphs live
+        tokenizer, model, device = load_bge_m3(model_path)
         best_text = None
         best_score = -1.0
         batch_size = 16
         for i in range(0, len(paras), batch_size):
             batch = paras[i : i + batch_size]
-            enc = tokenizer(
-                batch,
-                padding=True,
-                truncation=True,
-                return_tensors="pt",
-                max_length=tokenizer.model_max_length,
-            )
-            enc = {k: v.to(device) for k, v in enc.items()}
-            with torch.no_grad():
-                out = model(**enc)
-                mask = enc["attention_mask"].unsqueeze(-1).expand(out.last_hidden_state.size()).float()
-                pooled = (out.last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
-                pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
-            for text, vec in zip(batch, pooled.cpu().tolist()):
+            vecs = encode_bge_m3(batch, tokenizer, model, device, max_length=tokenizer.model_max_length)
+            for text, vec in zip(batch, vecs):
                 score = dot(qvec, vec)
                 if score > best_score:
                     best_score = score
@@ -284,14 +492,413 @@ def search_bge_m3(
     return final
 
 
+def load_bm25() -> BM25Index:
+    global _BM25
+    if _BM25 is None:
+        if not bm25_exists(SEARCH_DIR):
+            raise SystemExit(f"No BM25 index in {SEARCH_DIR}; rebuild it with build_search_index.py")
+        _BM25 = BM25Index.load(SEARCH_DIR)
+    return _BM25
+
+
+def search_bm25(query: str, top: int = 10) -> List[Tuple[str, float]]:
+    return load_bm25().search(query_terms(query), top)
+
+
+def attach_best_paragraph_bm25(query: str, results: List[Tuple[str, float]]) -> List[Tuple[str, float, str | None]]:
+    corpus = load_corpus()
+    terms = query_terms(query)
+    return [(doc_id, sim, best_paragraph_lexical(corpus.paragraphs(doc_id), terms)) for doc_id, sim in results]
+
+
+def search_hybrid(
+    query: str, dense: str, top: int = 10, model_path: str = "BAAI/bge-m3", ann_probe: int = 0
+) -> List[Tuple[str, float, str | None]]:
+    """RRF of the dense ranking (hash or bge-m3) and BM25; snippets come from the dense backend."""
+    lexical = search_bm25(query, RRF_DEPTH)
+    if dense == "bge-m3":
+        qvec = embed_bge_m3_query(query, model_path)
+        fused = rrf([rank_docs(SEARCH_DIR_BGE, qvec, RRF_DEPTH, ann_probe), lexical], top)
+        return attach_best_paragraph_bge_m3(qvec, fused, model_path)
+    fused = rrf([search(query, top=RRF_DEPTH, ann_probe=ann_probe), lexical], top)
+    return attach_best_paragraph_hash(query, fused)
+
+
+def rank(
+    query: str,
+    backend: str = "hash",
+    top: int = 10,
+    model_path: str = "BAAI/bge-m3",
+    ann_probe: int = 0,
+    chunk_top_m: int = CHUNK_TOP_M,
+) -> List[Tuple[str, float]]:
+    """Ranked (doc_id, score) for any backend, without snippets (what answer() ranks by)."""
+    if backend == "hash":
+        return search(query, top=top, ann_probe=ann_probe)
+    if backend == "bge-m3":
+        return rank_docs(SEARCH_DIR_BGE, embed_bge_m3_query(query, model_path), top, ann_probe)
+    if backend == "bge-m3-chunks":
+        return rank_chunks(embed_bge_m3_query(query, model_path), top, chunk_top_m)
+    if backend == "bm25":
+        return search_bm25(query, top)
+    if backend in ("hash+bm25", "bge-m3+bm25"):
+        dense = rank(query, backend.split("+")[0], RRF_DEPTH, model_path, ann_probe)
+        return rrf([dense, search_bm25(query, RRF_DEPTH)], top)
+    raise ValueError(f"Unknown backend '{backend}' (expected one of {', '.join(BACKENDS)})")
+
+
+def answer(
+    query: str,
+    backend: str = "hash",
+    top: int = 10,
+    model_path: str = "BAAI/bge-m3",
+    ann_probe: int = 0,
+    chunk_top_m: int = CHUNK_TOP_M,
+) -> Dict:
+    """One query as a JSON-friendly dict (results with best paragraph, expansion for hash)."""
+    t0 = time.perf_counter()
+    response: Dict = {"query": query, "backend": backend}
+    if backend == "bge-m3":
+        hits = search_bge_m3(query, top=top, model_path=model_path, with_paragraphs=True, ann_probe=ann_probe)
+    elif backend == "bge-m3-chunks":
+        qvec = embed_bge_m3_query(query, model_path)
+        hits = attach_best_paragraph_bge_m3(qvec, rank_chunks(qvec, top, chunk_top_m), model_path)
+    elif backend == "hash":
+        response["expansion"] = {k: [t for t, _ in v] for k, v in expand_query(query).items()}
+        hits = attach_best_paragraph_hash(query, search(query, top=top, ann_probe=ann_probe))
+    elif backend == "bm25":
+        hits = attach_best_paragraph_bm25(query, search_bm25(query, top))
+    elif backend in ("hash+bm25", "bge-m3+bm25"):
+        hits = search_hybrid(query, backend.split("+")[0], top=top, model_path=model_path, ann_probe=ann_probe)
+    else:
+        raise ValueError(f"Unknown backend '{backend}' (expected one of {', '.join(BACKENDS)})")
+    response["results"] = [{"doc_id": d, "score": round(sim, 6), "paragraph": p} for d, sim, p in hits]
+    response["took_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    return response
+
+
+def read_queries(path: str) -> List[Dict]:
+    """Batch input: JSONL rows with "q" (or "query") and an optional "id"; plain text lines also work."""
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                row = json.loads(line)
+                text = row.get("q", row.get("query", ""))
+                queries.append({"id": row.get("id", n), "q": str(text)})
+            else:
+                queries.append({"id": n, "q": line})
+    return queries
+
+
+def batch_search(
+    queries: List[str],
+    backend: str = "hash",
+    top: int = 10,
+    model_path: str = "BAAI/bge-m3",
+    batch_size: int = 32,
+    chunk_top_m: int = CHUNK_TOP_M,
+) -> Tuple[List[List[Tuple[str, float]]], Dict[str, float]]:
+    """Rank docs for many queries: embed in batches, score with one matrix-matrix product.
+
+    Exact search only; results match search() / search_bge_m3() for the same query.
+    "<dense>+bm25" fuses the batch rankings of both backends per query, as rank() does.
+    """
+    if backend in ("hash+bm25", "bge-m3+bm25"):
+        dense, dense_timing = batch_search(queries, backend.split("+")[0], RRF_DEPTH, model_path, batch_size)
+        lexical, lexical_timing = batch_search(queries, "bm25", RRF_DEPTH, model_path, batch_size)
+        t_fuse = time.perf_counter()
+        results = [rrf([d, lex], top) for d, lex in zip(dense, lexical)]
+        timing = {k: dense_timing[k] + lexical_timing[k] for k in dense_timing}
+        timing["score_s"] += time.perf_counter() - t_fuse
+        return results, timing
+    t0 = time.perf_counter()
+    if backend in ("bge-m3", "bge-m3-chunks"):
+        if backend == "bge-m3":
+            doc_ids, matrix = load_doc_matrix(SEARCH_DIR_BGE)
+        else:
+            chunks = load_chunk_index()
+            doc_ids, matrix = chunks.doc_ids, chunks.matrix
+        tokenizer, model, device = load_bge_m3(model_path)
+        t_load = time.perf_counter()
+        vecs: List[List[float]] = []
+        for i in range(0, len(queries), batch_size):
+            vecs.extend(encode_bge_m3(queries[i : i + batch_size], tokenizer, model, device))
+    elif backend == "hash":
+        doc_ids, matrix = load_doc_matrix(SEARCH_DIR)
+        load_vocab_matrix()
+        load_vocab_knn()
+        t_load = time.perf_counter()
+        vecs = [query_vector(q) for q in queries]
+    elif backend == "bm25":
+        # sparse scoring: no matrix product, one bincount per query
+        index = load_bm25()
+        t_load = time.perf_counter()
+        results = [index.search(query_terms(q), top) for q in queries]
+        t_score = time.perf_counter()
+        return results, {"load_s": t_load - t0, "embed_s": 0.0, "score_s": t_score - t_load}
+    else:
+        raise ValueError(f"Unknown backend '{backend}' (expected one of {', '.join(BACKENDS)})")
+    t_embed = time.perf_counter()
+
+    results: List[List[Tuple[str, float]]] = [[] for _ in queries]
+    if doc_ids and queries:
+        qmat = np.asarray(vecs, dtype=np.float32).reshape(len(queries), matrix.shape[1])
+        if backend == "bge-m3-chunks":
+            scores = chunks.doc_scores(qmat, chunk_top_m)
+        else:
+            scores = qmat @ matrix.T
+        rows = np.argsort(-scores, axis=1, kind="stable")[:, :top]
+        best = np.take_along_axis(scores, rows, axis=1)
+        results = [
+            [(doc_ids[i], float(sc)) for i, sc in zip(row_ids, row_scores)] for row_ids, row_scores in zip(rows, best)
+        ]
+    t_score = time.perf_counter()
+    timing = {
+        "load_s": t_load - t0,
+        "embed_s": t_embed - t_load,
+        "score_s": t_score - t_embed,
+    }
+    return results, timing
+
+
+def run_batch(
+    in_path: str,
+    out_path: str | None,
+    backend: str,
+    top: int,
+    model_path: str,
+    batch_size: int,
+    chunk_top_m: int = CHUNK_TOP_M,
+) -> None:
+    queries = read_queries(in_path)
+    t0 = time.perf_counter()
+    results, timing = batch_search([q["q"] for q in queries], backend, top, model_path, batch_size, chunk_top_m)
+    out = open(out_path, "w", encoding="utf-8") if out_path else sys.stdout
+    try:
+        for query, hits in zip(queries, results):
+            row = {
+                "id": query["id"],
+                "q": query["q"],
+                "backend": backend,
+                "results": [{"doc_id": d, "score": round(sc, 6)} for d, sc in hits],
+            }
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+    finally:
+        if out_path:
+            out.close()
+    total = time.perf_counter() - t0
+    work = timing["embed_s"] + timing["score_s"]
+    print(
+        f"{len(queries)} queries ({backend}) in {total:.2f}s: load {timing['load_s']:.2f}s, "
+        f"embed {timing['embed_s']:.3f}s, score {timing['score_s'] * 1000:.1f}ms; "
+        f"{len(queries) / work if work else 0:.1f} queries/s excluding load, "
+        f"{len(queries) / total if total else 0:.1f} overall",
+        file=sys.stderr,
+    )
+
+
+def print_answer(response: Dict) -> None:
+    if "expansion" in response:
+        print("Query expansion:")
+        for k, v in response["expansion"].items():
+            print(f"  {k}: {v}")
+        print()
+    print(f"Top results ({response['backend']}):")
+    for hit in response["results"]:
+        print(f"  {hit['doc_id']}\t{hit['score']:.4f}")
+        if hit["paragraph"]:
+            print(f"    {hit['paragraph']}")
+
+
+def preload(backends: List[str], model_path: str) -> None:
+    """Load indexes, corpus offsets and (for bge-m3) the model up front."""
+    load_corpus()
+    if "hash" in backends:
+        load_hasher()
+        load_doc_matrix(SEARCH_DIR)
+        load_vocab_matrix()
+        load_vocab_knn()
+        load_paragraph_index(SEARCH_DIR)
+    if "bm25" in backends:
+        load_bm25()
+    if "bge-m3" in backends:
+        load_doc_matrix(SEARCH_DIR_BGE)
+    if "bge-m3-chunks" in backends:
+        load_chunk_index()
+    if "bge-m3" in backends or "bge-m3-chunks" in backends:
+        load_paragraph_index(SEARCH_DIR_BGE)
+        load_bge_m3(model_path)
+
+
+def preload_available(model_path: str) -> List[str]:
+    """Preload every backend whose index exists; bge-m3 is skipped without torch/transformers."""
+    backends = []
+    if has_doc_vectors(SEARCH_DIR):
+        preload(["hash"], model_path)
+        backends.append("hash")
+    if bm25_exists(SEARCH_DIR):
+        preload(["bm25"], model_path)
+        backends.append("bm25")
+    if has_doc_vectors(SEARCH_DIR_BGE):
+        try:
+            preload(["bge-m3"], model_path)
+            backends.append("bge-m3")
+            if chunk_index_exists(SEARCH_DIR_BGE):
+                preload(["bge-m3-chunks"], model_path)
+                backends.append("bge-m3-chunks")
+        except SystemExit as exc:
+            print(f"bge-m3 not loaded: {exc}", file=sys.stderr)
+    return backends
+
+
+def repl(backend: str, top: int, model_path: str, ann_probe: int, chunk_top_m: int = CHUNK_TOP_M) -> None:
+    t0 = time.perf_counter()
+    loaded = preload_available(model_path)
+    print(f"Loaded {', '.join(loaded) or 'nothing'} in {time.perf_counter() - t0:.1f}s.", file=sys.stderr)
+    print(f"One query per line; :backend {'|'.join(BACKENDS)}, :top N, :reload, :quit", file=sys.stderr)
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith(":"):
+            cmd, _, arg = line[1:].partition(" ")
+            if cmd in ("quit", "q"):
+                break
+            if cmd == "backend" and arg in BACKENDS:
+                backend = arg
+            elif cmd == "top" and arg.isdigit():
+                top = int(arg)
+            elif cmd == "reload":
+                reset_caches()
+                preload_available(model_path)
+            else:
+                print(f"Unknown command: {line}", file=sys.stderr)
+            continue
+        response = answer(
+            line, backend=backend, top=top, model_path=model_path, ann_probe=ann_probe, chunk_top_m=chunk_top_m
+        )
+        print_answer(response)
+        print(f"({response['took_ms']:.1f} ms)\n", flush=True)
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    """JSON lines: {"q": ..., "backend": ..., "top": ...} in, one answer() dict out per line.
+
+    "ann_probe" and "chunk_top_m" override the daemon's defaults per request.
+    """
+
+    def handle(self) -> None:
+        for raw in self.rfile:
+            raw = raw.strip()
+            if not raw:
+                continue
+            try:
+                req = json.loads(raw)
+                if req.get("cmd") == "reload":
+                    reset_caches()
+                    response: Dict = {"reloaded": preload_available(self.server.model_path)}
+                else:
+                    response = answer(
+                        str(req.get("q", "")).strip(),
+                        backend=req.get("backend", self.server.backend),
+                        top=int(req.get("top", self.server.top)),
+                        model_path=self.server.model_path,
+                        ann_probe=int(req.get("ann_probe", self.server.ann_probe)),
+                        chunk_top_m=max(1, int(req.get("chunk_top_m", self.server.chunk_top_m))),
+                    )
+            except Exception as exc:
+                response = {"error": str(exc)}
+            self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+def daemon(
+    socket_path: str, backend: str, top: int, model_path: str, ann_probe: int, chunk_top_m: int = CHUNK_TOP_M
+) -> None:
+    t0 = time.perf_counter()
+    loaded = preload_available(model_path)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    # one request at a time: the model and caches are shared
+    server = socketserver.UnixStreamServer(socket_path, QueryHandler)
+    server.backend, server.top, server.model_path, server.ann_probe = backend, top, model_path, ann_probe
+    server.chunk_top_m = chunk_top_m
+    print(
+        f"Loaded {', '.join(loaded) or 'nothing'} in {time.perf_counter() - t0:.1f}s; listening on {socket_path}",
+        file=sys.stderr,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def query_daemon(socket_path: str, request: Dict) -> Dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+        sock.shutdown(socket.SHUT_WR)
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data)
+
+
 def main() -> None:
     if len(sys.argv) < 2:
-        print("Usage: python3 search_query.py \"your query\" [--top N]")
+        print(
+            "Usage: python3 search_query.py \"your query\" [--backend hash|bge-m3|bge-m3-chunks|bm25|hash+bm25|bge-m3+bm25] "
+            "[--ann-probe N] [--chunk-top-m M] [--top N]\n"
+            "       python3 search_query.py --repl | --daemon SOCKET | --connect SOCKET \"your query\"\n"
+            "       python3 search_query.py --batch queries.jsonl [--out results.jsonl] [--batch-size N]"
+        )
         return
     args = sys.argv[1:]
     top = 10
     backend = "hash"
     model_path = "BAAI/bge-m3"
+    ann_probe = 0
+    chunk_top_m = CHUNK_TOP_M
+    mode = None
+    socket_path = None
+    batch_path = None
+    out_path = None
+    batch_size = 32
+    if "--repl" in args:
+        mode = "repl"
+        args.remove("--repl")
+    for flag in ("--daemon", "--connect"):
+        if flag in args:
+            idx = args.index(flag)
+            mode = flag[2:]
+            socket_path = args[idx + 1] if idx + 1 < len(args) else None
+            args = args[:idx] + args[idx + 2 :]
+    if "--batch" in args:
+        idx = args.index("--batch")
+        mode = "batch"
+        batch_path = args[idx + 1] if idx + 1 < len(args) else None
+        args = args[:idx] + args[idx + 2 :]
+    if "--out" in args:
+        idx = args.index("--out")
+        out_path = args[idx + 1] if idx + 1 < len(args) else None
+        args = args[:idx] + args[idx + 2 :]
+    if "--batch-size" in args:
+        idx = args.index("--batch-size")
+        try:
+            batch_size = int(args[idx + 1])
+        except Exception:
+            pass
+        args = args[:idx] + args[idx + 2 :]
     if "--backend" in args:
         idx = args.index("--backend")
         backend = args[idx + 1] if idx + 1 < len(args) else "hash"
@@ -300,6 +907,20 @@ def main() -> None:
         idx = args.index("--model-path")
         model_path = args[idx + 1] if idx + 1 < len(args) else model_path
         args = args[:idx] + args[idx + 2 :]
+    if "--ann-probe" in args:
+        idx = args.index("--ann-probe")
+        try:
+            ann_probe = int(args[idx + 1])
+        except Exception:
+            pass
+        args = args[:idx] + args[idx + 2 :]
+    if "--chunk-top-m" in args:
+        idx = args.index("--chunk-top-m")
+        try:
+            chunk_top_m = max(1, int(args[idx + 1]))
+        except Exception:
+            pass
+        args = args[:idx] + args[idx + 2 :]
     if "--top" in args:
         idx = args.index("--top")
         try:
@@ -309,24 +930,32 @@ def main() -> None:
         args = args[:idx]
     query = " ".join(args).strip()
 
-    if backend == "bge-m3":
-        print("\nTop results (bge-m3):")
-        for doc_id, sim, para in search_bge_m3(query, top=top, model_path=model_path, with_paragraphs=True):
-            print(f"  {doc_id}\t{sim:.4f}")
-            if para:
-                print(f"    {para}")
+    if mode in ("daemon", "connect") and not socket_path:
+        raise SystemExit(f"--{mode} needs a socket path")
+    if mode == "batch":
+        if not batch_path:
+            raise SystemExit("--batch needs a queries file")
+        run_batch(batch_path, out_path, backend, top, model_path, batch_size, chunk_top_m)
+        return
+    if mode == "repl":
+        repl(backend, top, model_path, ann_probe, chunk_top_m)
+        return
+    if mode == "daemon":
+        daemon(socket_path, backend, top, model_path, ann_probe, chunk_top_m)
+        return
+    if mode == "connect":
+        response = query_daemon(
+            socket_path,
+            {"q": query, "backend": backend, "top": top, "ann_probe": ann_probe, "chunk_top_m": chunk_top_m},
+        )
+        if "error" in response:
+            raise SystemExit(response["error"])
+        print_answer(response)
         return
 
-    exp = expand_query(query)
-    print("Query expansion:")
-    for k, v in exp.items():
-        print(f"  {k}: {[t for t,_ in v]}")
-
-    print("\nTop results (hash):")
-    for doc_id, sim, para in attach_best_paragraph_hash(query, search(query, top=top)):
-        print(f"  {doc_id}\t{sim:.4f}")
-        if para:
-            print(f"    {para}")
+    print_answer(
+        answer(query, backend=backend, top=top, model_path=model_path, ann_probe=ann_probe, chunk_top_m=chunk_top_m)
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Per-stage latency histograms and counters with a Prometheus text exposition.
+
+Each stage (tokenize, forward, score, ...) keeps cumulative histogram buckets,
+sum and count (exported as a Prometheus histogram) plus a window of recent
+samples from which p50/p95/p99 are computed (exported as gauges).
+Counters may carry labels (e.g. mode="dense+sparse"); metric names are
+reduced to the characters Prometheus accepts.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def metric_name(name: str) -> str:
+    """name with every character outside [a-zA-Z0-9_:] replaced by '_'."""
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+
+
+def format_labels(labels: Labels) -> str:
+    parts = []
+    for key, value in labels:
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{metric_name(key)}="{value}"')
+    return ",".join(parts)
+
+
+class _Stage:
+    def __init__(self, n_buckets: int, window: int):
+        self.buckets = [0] * n_buckets
+        self.sum = 0.0
+        self.count = 0
+        self.recent: "deque[float]" = deque(maxlen=window)
+
+
+def quantile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+class StageMetrics:
+    def __init__(self, prefix: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS, window: int = 1024):
+        self.prefix = prefix
+        self.bucket_bounds = buckets
+        self.window = window
+        self._stages: Dict[str, _Stage] = {}
+        self._counters: Dict[str, float] = {}
+        self._labelled: Dict[Tuple[str, Labels], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            st = self._stages.get(stage)
+            if st is None:
+                st = self._stages[stage] = _Stage(len(self.bucket_bounds), self.window)
+            for i, bound in enumerate(self.bucket_bounds):
+                if seconds <= bound:
+                    st.buckets[i] += 1
+            st.sum += seconds
+            st.count += 1
+            st.recent.append(seconds)
+
+    @contextmanager
+    def timer(self, stage: str, on_done: Callable[[float], None] | None = None) -> Iterator[None]:
+        """Observe the duration of the block; on_done(seconds) also receives it."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            self.observe(stage, elapsed)
+            if on_done is not None:
+                on_done(elapsed)
+
+    def inc(self, name: str, value: float = 1, labels: Dict[str, str] | None = None) -> None:
+        with self._lock:
+            if labels:
+                key = (name, tuple(sorted(labels.items())))
+                self._labelled[key] = self._labelled.get(key, 0) + value
+            else:
+                self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self) -> Dict:
+        """JSON-friendly view: count/sum and recent quantiles (ms) per stage, plus counters."""
+        with self._lock:
+            stages = {name: (st.count, st.sum, sorted(st.recent)) for name, st in self._stages.items()}
+            counters = dict(self._counters)
+            counters.update({f"{name}{{{format_labels(labels)}}}": v for (name, labels), v in self._labelled.items()})
+        out: Dict = {"stages": {}, "counters": counters}
+        for name, (count, total, recent) in sorted(stages.items()):
+            entry = {"count": count, "sum_s": round(total, 6)}
+            for q in QUANTILES:
+                entry[f"p{int(q * 100)}_ms"] = round(quantile(recent, q) * 1000, 3)
+            out["stages"][name] = entry
+        return out
+
+    def render_prometheus(self, gauges: Dict[str, float] | None = None, counters: Dict[str, float] | None = None) -> str:
+        """Prometheus text format 0.0.4. Extra gauges/counters (e.g. cache stats) are appended."""
+        with self._lock:
+            stages = {
+                name: (list(st.buckets), st.sum, st.count, sorted(st.recent)) for name, st in self._stages.items()
+            }
+            own_counters = dict(self._counters)
+            labelled = dict(self._labelled)
+        name = f"{self.prefix}_stage_seconds"
+        lines = [
+            f"# HELP {name} Latency per search stage.",
+            f"# TYPE {name} histogram",
+        ]
+        for stage, (buckets, total, count, _) in sorted(stages.items()):
+            for bound, n in zip(self.bucket_bounds, buckets):
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound:g}"}} {n}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+
+        qname = f"{self.prefix}_stage_recent_seconds"
+        lines.append(f"# HELP {qname} Latency quantiles over the last {self.window} samples per stage.")
+        lines.append(f"# TYPE {qname} gauge")
+        for stage, (_, _, _, recent) in sorted(stages.items()):
+            for q in QUANTILES:
+                lines.append(f'{qname}{{stage="{stage}",quantile="{q:g}"}} {quantile(recent, q):.6f}')
+
+        all_counters = dict(own_counters)
+        all_counters.update(counters or {})
+        for cname, value in sorted(all_counters.items()):
+            full = metric_name(f"{self.prefix}_{cname}_total")
+            lines.append(f"# TYPE {full} counter")
+            lines.append(f"{full} {value:g}")
+        typed = set()
+        for (cname, labels), value in sorted(labelled.items()):
+            full = metric_name(f"{self.prefix}_{cname}_total")
+            if full not in typed:
+                typed.add(full)
+                lines.append(f"# TYPE {full} counter")
+            lines.append(f"{full}{{{format_labels(labels)}}} {value:g}")
+        for gname, value in sorted((gauges or {}).items()):
+            full = metric_name(f"{self.prefix}_{gname}")
+            lines.append(f"# TYPE {full} gauge")
+            lines.append(f"{full} {value:g}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Binary vector store: a .npy matrix plus a JSON header with row ids and model info.
+
+  <name>.npy   rows x dim, float32 (default) or float16
+  <name>.json  {"format": 1, "file": "<name>.npy", "ids": [...], "rows", "dim",
+                "dtype", "model", "normalized"}
+
+float32 stores are memory-mapped read-only, so opening an index neither parses
+nor copies the vectors. float16 halves the file; it is converted to float32
+once at load, since NumPy has no fast float16 matrix product.
+
+Both index builders write `doc_vectors.{npy,json}`. It replaces
+doc_embeddings.jsonl; load_doc_vectors() still reads that file for indexes
+built before the store existed.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+FORMAT_VERSION = 1
+DOC_VECTORS = "doc_vectors"
+LEGACY_DOC_JSONL = "doc_embeddings.jsonl"
+DTYPES = ("float32", "float16")
+
+
+def matrix_path(index_dir: str, name: str) -> str:
+    return os.path.join(index_dir, f"{name}.npy")
+
+
+def header_path(index_dir: str, name: str) -> str:
+    return os.path.join(index_dir, f"{name}.json")
+
+
+def exists(index_dir: str, name: str) -> bool:
+    return os.path.exists(matrix_path(index_dir, name)) and os.path.exists(header_path(index_dir, name))
+
+
+def save(
+    index_dir: str,
+    name: str,
+    ids: List[str],
+    matrix: np.ndarray,
+    model: str,
+    normalized: bool = True,
+    dtype: str = "float32",
+) -> Dict:
+    """Write <name>.npy and its header; returns the header (minus ids) for index_meta.json."""
+    if dtype not in DTYPES:
+        raise ValueError(f"Unknown vector dtype '{dtype}' (expected one of {', '.join(DTYPES)})")
+    mat = np.ascontiguousarray(matrix, dtype=dtype)
+    if mat.ndim != 2 or mat.shape[0] != len(ids):
+        raise ValueError(f"{name}: {len(ids)} ids for a matrix of shape {mat.shape}")
+    np.save(matrix_path(index_dir, name), mat)
+    header = {
+        "format": FORMAT_VERSION,
+        "file": os.path.basename(matrix_path(index_dir, name)),
+        "rows": int(mat.shape[0]),
+        "dim": int(mat.shape[1]),
+        "dtype": dtype,
+        "model": model,
+        "normalized": normalized,
+    }
+    with open(header_path(index_dir, name), "w", encoding="utf-8") as f:
+        json.dump(dict(header, ids=list(ids)), f, ensure_ascii=False)
+    return header
+
+
+def load(index_dir: str, name: str, mmap: bool = True) -> Tuple[List[str], np.ndarray, Dict]:
+    """(ids, float32 matrix, header). float32 files are memory-mapped unless mmap=False."""
+    with open(header_path(index_dir, name), "r", encoding="utf-8") as f:
+        header = json.load(f)
+    if header.get("format") != FORMAT_VERSION:
+        raise ValueError(f"{header_path(index_dir, name)}: unsupported vector store format {header.get('format')}")
+    ids = header.pop("ids")
+    use_mmap = mmap and header["rows"] > 0 and header["dtype"] == "float32"
+    mat = np.load(matrix_path(index_dir, name), mmap_mode="r" if use_mmap else None)
+    if mat.shape != (header["rows"], header["dim"]) or len(ids) != header["rows"]:
+        raise ValueError(
+            f"{matrix_path(index_dir, name)}: shape {mat.shape} does not match its header "
+            f"({header['rows']} x {header['dim']}, {len(ids)} ids)"
+        )
+    if mat.dtype != np.float32:
+        mat = mat.astype(np.float32)
+    return ids, mat, header
+
+
+def load_doc_vectors(index_dir: str) -> Tuple[List[str], np.ndarray]:
+    """Doc ids and vectors of an index: doc_vectors.npy, or doc_embeddings.jsonl for older indexes."""
+    if exists(index_dir, DOC_VECTORS):
+        ids, mat, _ = load(index_dir, DOC_VECTORS)
+        return ids, mat
+    doc_ids: List[str] = []
+    vectors: List[List[float]] = []
+    with open(os.path.join(index_dir, LEGACY_DOC_JSONL), "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            vec = row.get("vector") or []
+            if vec:
+                doc_ids.append(row.get("doc_id"))
+                vectors.append(vec)
+    if not vectors:
+        return doc_ids, np.zeros((0, 0), dtype=np.float32)
+    return doc_ids, np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+
+
+def has_doc_vectors(index_dir: str) -> bool:
+    return exists(index_dir, DOC_VECTORS) or os.path.exists(os.path.join(index_dir, LEGACY_DOC_JSONL))
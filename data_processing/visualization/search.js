@@ -21,30 +21,74 @@ function highlight(text, query) {
   return out;
 }
 
+function renderResults(results, query) {
+  resultsEl.innerHTML = "";
+  const snippetEls = new Map();
+  for (const r of results) {
+    const card = document.createElement("div");
+    card.className = "result-card";
+    card.innerHTML = `
+      <div class="result-title">${r.title || r.doc_id}</div>
+      <div class="result-meta">${r.doc_id} · score ${r.score.toFixed(4)}</div>
+      <div class="result-snippet">${r.snippet === undefined ? "…" : highlight(r.snippet || "", query)}</div>
+    `;
+    resultsEl.appendChild(card);
+    snippetEls.set(r.doc_id, card.querySelector(".result-snippet"));
+  }
+  return snippetEls;
+}
+
+// NDJSON stream: {"event":"results"} first, then one {"event":"snippet"} per hit
+async function readStream(res, query) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let snippetEls = new Map();
+  const handle = (line) => {
+    if (!line.trim()) return;
+    const msg = JSON.parse(line);
+    if (msg.event === "results") {
+      const results = msg.results || [];
+      snippetEls = renderResults(results, query);
+      statusEl.textContent = `Results: ${results.length} (loading snippets…)`;
+    } else if (msg.event === "snippet") {
+      const el = snippetEls.get(msg.doc_id);
+      if (el) el.innerHTML = highlight(msg.snippet || "", query);
+    } else if (msg.event === "done") {
+      statusEl.textContent = `Results: ${snippetEls.size}`;
+    }
+  };
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split("\n");
+    buffer = lines.pop();
+    lines.forEach(handle);
+  }
+  handle(buffer + decoder.decode());
+}
+
 async function search(query) {
   const top = parseInt(topKSelect.value, 10) || 10;
   const expand = expandToggle.checked ? 1 : 0;
+  const stream = window.TextDecoder && window.Response && "body" in Response.prototype ? 1 : 0;
   statusEl.textContent = "Searching…";
-  const res = await fetch(`/api/search?q=${encodeURIComponent(query)}&top=${top}&expand=${expand}`);
+  const res = await fetch(
+    `/api/search?q=${encodeURIComponent(query)}&top=${top}&expand=${expand}&stream=${stream}`
+  );
   if (!res.ok) {
     statusEl.textContent = `Search failed (${res.status})`;
     return;
   }
+  if (stream) {
+    await readStream(res, query);
+    return;
+  }
   const data = await res.json();
   const results = data.results || [];
-  resultsEl.innerHTML = "";
   statusEl.textContent = `Results: ${results.length}`;
-
-  for (const r of results) {
-    const card = document.createElement("div");
-    card.className = "result-card";
-    card.innerHTML = `
-      <div class="result-title">${r.title || r.doc_id}</div>
-      <div class="result-meta">${r.doc_id} · score ${r.score.toFixed(4)}</div>
-      <div class="result-snippet">${highlight(r.snippet || "", query)}</div>
-    `;
-    resultsEl.appendChild(card);
-  }
+  renderResults(results, query);
 }
 
 const isGitHubPages = () => window.location.hostname.endsWith("github.io");
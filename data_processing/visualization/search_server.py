@@ -6,22 +6,76 @@ Run:
 
 Then open:
   http://localhost:8000/visualization/search.html
+
+Concurrent mode (threaded HTTP server; queries are embedded in micro-batches
+by a single inference worker):
+  python3 search_server.py --concurrent --max-batch 32 --batch-wait-ms 5
+
+Query embeddings are kept in an LRU cache (--cache-size, --cache-ttl);
+hit/miss/eviction counts are served at /api/cache.
+
+/api/search?q=...&stream=1 answers with NDJSON events: the ranked hits
+({"event": "results"}) as soon as docs are scored, then one {"event": "snippet"}
+per hit, then {"event": "done"}.
+
+Per-stage latency histograms (tokenize, forward, embed, score, snippet,
+serialize, total) and counters are exported in Prometheus text format at
+/api/metrics; --log-stages prints a per-request breakdown.
+
+With --preload the model is loaded and warmed up in the background at startup;
+/healthz reports load state and timings, /readyz answers 503 until warm.
+
+mode=bm25 ranks with the BM25 inverted index written by build_search_index.py
+(no model call); mode=hybrid fuses the BGE-M3 and BM25 rankings by reciprocal rank.
+mode=chunks scores each doc by its best chunk vector (--chunk-top-m > 1: the mean
+of its best chunks) instead of the mean doc vector; see multi_vector.py.
+mode=sparse ranks with BGE-M3's lexical token weights (sparse_postings.npz, see
+bge_m3_sparse.py), taken from the same forward pass as the query vector;
+mode=dense+sparse adds them to the exact dense score (dense + --sparse-weight x sparse).
 """
 
 from __future__ import annotations
 
+import argparse
 import json
 import os
+import queue
 import re
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from http.server import HTTPServer, SimpleHTTPRequestHandler, ThreadingHTTPServer
+import sys
 from urllib.parse import urlparse, parse_qs
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
 
 BASE_DIR = "/Users/TH_1/Documents/Repo/ACO/data_processing"
 MODEL_DIR = os.path.join(BASE_DIR, "models", "bge-m3")
 EMB_DIR = os.path.join(BASE_DIR, "output", "search_index_bge_m3")
+BM25_DIR = os.path.join(BASE_DIR, "output", "search_index")
 CORPUS_PATH = os.path.join(BASE_DIR, "output", "corpus.jsonl")
 
+# shared helpers live next to the index builders
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+
+from ann_index import index_path, load_for  # noqa: E402
+from bm25_index import RRF_DEPTH, BM25Index, query_terms, rrf  # noqa: E402
+from bm25_index import best_paragraph as best_paragraph_lexical  # noqa: E402
+from bm25_index import exists as bm25_exists  # noqa: E402
+from bge_m3_quantization import QUANTIZATION_MODES, quantize_model  # noqa: E402
+from bge_m3_sparse import SPARSE_WEIGHT, SparseIndex, Weights, load_sparse_head, token_weights  # noqa: E402
+from bge_m3_sparse import exists as sparse_exists  # noqa: E402
+from corpus_reader import CorpusReader  # noqa: E402
+from embedding_cache import EmbeddingCache  # noqa: E402
+from multi_vector import ChunkIndex  # noqa: E402
+from multi_vector import exists as chunk_index_exists  # noqa: E402
+from stage_metrics import StageMetrics  # noqa: E402
+from vector_store import load_doc_vectors  # noqa: E402
+
 
 def resolve_model_path(model_path: str) -> str:
     if os.path.isdir(model_path) and not os.path.isfile(os.path.join(model_path, "config.json")):
@@ -57,29 +111,134 @@ def read_jsonl(path: str) -> List[Dict]:
     return rows
 
 
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first."""
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+def load_paragraph_index(emb_dir: str) -> Tuple[Dict[str, Tuple[int, int]], np.ndarray | None]:
+    """Precomputed paragraph vectors and doc_id -> (start, count) row ranges, if built."""
+    index_path = os.path.join(emb_dir, "paragraph_index.jsonl")
+    matrix_path = os.path.join(emb_dir, "paragraph_embeddings.npy")
+    if not (os.path.exists(index_path) and os.path.exists(matrix_path)):
+        return {}, None
+    ranges = {row["doc_id"]: (row["start"], row["count"]) for row in read_jsonl(index_path)}
+    return ranges, np.load(matrix_path, mmap_mode="r")
+
+
 # Load metadata and embeddings at startup
 DOCS = {d["doc_id"]: d for d in read_jsonl(os.path.join(EMB_DIR, "docs.jsonl"))}
-DOC_EMB = read_jsonl(os.path.join(EMB_DIR, "doc_embeddings.jsonl"))
+# doc_vectors.npy is memory-mapped (older indexes: parsed from doc_embeddings.jsonl)
+DOC_IDS, DOC_MATRIX = load_doc_vectors(EMB_DIR)
+
+# Paragraphs for snippets; rows are read on demand via corpus_offsets.json
+CORPUS = CorpusReader(CORPUS_PATH)
+PARA_RANGES, PARA_MATRIX = load_paragraph_index(EMB_DIR)
+
+# Optional IVF index over DOC_MATRIX rows; used when --ann-probe > 0
+DOC_ANN = load_for(index_path(EMB_DIR, "doc"), DOC_MATRIX)
+ANN_PROBE = 0
 
-# Paragraphs for snippets
-CORPUS = {d.get("doc_id"): d for d in read_jsonl(CORPUS_PATH)}
+# Lexical index for mode=bm25 / mode=hybrid
+BM25 = BM25Index.load(BM25_DIR) if bm25_exists(BM25_DIR) else None
+SEARCH_MODES = ("dense", "bm25", "hybrid", "chunks", "sparse", "dense+sparse")
+
+# Per-chunk vectors for mode=chunks; None for indexes built before they were kept
+CHUNKS = ChunkIndex.load(EMB_DIR) if chunk_index_exists(EMB_DIR) else None
+CHUNK_TOP_M = 1
+
+# BGE-M3 lexical weights for mode=sparse / mode=dense+sparse; rows follow DOC_IDS
+SPARSE = SparseIndex.load(EMB_DIR) if sparse_exists(EMB_DIR) else None
+if SPARSE is not None and SPARSE.doc_ids != DOC_IDS:
+    print(f"Sparse index in {EMB_DIR} does not match doc_vectors.npy; rebuild it. Sparse modes disabled.")
+    SPARSE = None
 
 # Lazy model load
 TOKENIZER = None
 MODEL = None
+# sparse_linear.pt of the snapshot; loaded with the model when a sparse index exists
+SPARSE_HEAD = None
+LOAD_LOCK = threading.Lock()
+# one forward pass at a time, whichever thread asks
+MODEL_LOCK = threading.Lock()
+
+# Set in concurrent mode; see EmbeddingBatcher
+BATCHER = None
+
+# Reduced-precision inference mode (see bge_m3_quantization); set in main()
+QUANTIZE = "none"
+
+# Query vectors keyed by (model snapshot + quantization, normalized query); sized in main()
+MODEL_ID = f"{resolve_model_path(MODEL_DIR)}#{QUANTIZE}"
+QUERY_CACHE = EmbeddingCache(max_size=1024)
+CACHE_LOG_EVERY = 0
+
+# Model load state for /healthz and /readyz. "lazy" until the first load;
+# with --preload: loading -> warming -> ready (or error).
+STARTED_AT = time.time()
+PRELOAD = False
+MODEL_STATUS: Dict = {
+    "state": "lazy",
+    "load_s": None,
+    "warmup_s": None,
+    "warmup_batches": [],
+    "error": None,
+}
+
+
+# Per-stage latency histograms for /api/metrics. Stage times of the request
+# being handled on this thread are also summed into _REQUEST.timings so they
+# can be logged per request (--log-stages).
+METRICS = StageMetrics("aco_search")
+LOG_STAGES = False
+_REQUEST = threading.local()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    def add_to_request(elapsed: float) -> None:
+        timings = getattr(_REQUEST, "timings", None)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+    with METRICS.timer(name, on_done=add_to_request):
+        yield
 
 
 def load_model():
-    global TOKENIZER, MODEL
+    global TOKENIZER, MODEL, SPARSE_HEAD
     if TOKENIZER is not None and MODEL is not None:
         return
-    from transformers import AutoTokenizer, AutoModel
-    import torch
-
-    resolved = resolve_model_path(MODEL_DIR)
-    TOKENIZER = AutoTokenizer.from_pretrained(resolved, use_fast=False)
-    MODEL = AutoModel.from_pretrained(resolved)
-    MODEL.eval()
+    with LOAD_LOCK:
+        if TOKENIZER is not None and MODEL is not None:
+            return
+        from transformers import AutoTokenizer, AutoModel
+        import torch
+
+        MODEL_STATUS["state"] = "loading"
+        t0 = time.perf_counter()
+        try:
+            with stage("model_load"):
+                resolved = resolve_model_path(MODEL_DIR)
+                tokenizer = AutoTokenizer.from_pretrained(resolved, use_fast=False)
+                model = AutoModel.from_pretrained(resolved)
+                model.eval()
+                model = quantize_model(model, QUANTIZE)
+                if SPARSE is not None:
+                    SPARSE_HEAD = load_sparse_head(resolved, model.config.hidden_size)
+                    if SPARSE_HEAD is None:
+                        print(f"No sparse_linear.pt in {resolved}; sparse scores will be 0")
+        except Exception as exc:
+            MODEL_STATUS.update(state="error", error=f"{type(exc).__name__}: {exc}")
+            raise
+        TOKENIZER, MODEL = tokenizer, model
+        MODEL_STATUS.update(load_s=round(time.perf_counter() - t0, 3), state="loaded" if PRELOAD else "ready")
 
 
 def mean_pool(last_hidden_state, attention_mask):
@@ -92,103 +251,437 @@ def mean_pool(last_hidden_state, attention_mask):
     return summed / counts
 
 
-def embed_texts(texts: List[str]) -> List[List[float]]:
+def embed_texts(texts: List[str]) -> np.ndarray:
+    return encode_texts(texts)[0]
+
+
+def encode_texts(texts: List[str], sparse: bool = False) -> Tuple[np.ndarray, List[Weights] | None]:
+    """Dense vectors, plus the lexical weights from the same forward pass if sparse and a sparse head is loaded."""
     import torch
 
     load_model()
-    enc = TOKENIZER(
-        texts,
-        padding=True,
-        truncation=True,
-        return_tensors="pt",
-        max_length=TOKENIZER.model_max_length,
-    )
-    with torch.no_grad():
+    with stage("tokenize"):
+        enc = TOKENIZER(
+            texts,
+            padding=True,
+            truncation=True,
+            return_tensors="pt",
+            max_length=TOKENIZER.model_max_length,
+        )
+    with MODEL_LOCK, torch.no_grad(), stage("forward"):
         out = MODEL(**enc)
         pooled = mean_pool(out.last_hidden_state, enc["attention_mask"])
         pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
-    return pooled.cpu().tolist()
-
-
-def dot(a: List[float], b: List[float]) -> float:
-    return sum(x * y for x, y in zip(a, b))
-
-
-def best_paragraph(doc_id: str, qvec: List[float]) -> str | None:
-    entry = CORPUS.get(doc_id)
-    if not entry:
-        return None
-    paras = entry.get("paragraphs") or []
+        weights = None
+        if sparse and SPARSE_HEAD is not None:
+            weights = token_weights(
+                out.last_hidden_state, enc["input_ids"], enc["attention_mask"], SPARSE_HEAD, TOKENIZER.all_special_ids
+            )
+    METRICS.inc("forward_passes")
+    METRICS.inc("embedded_texts", len(texts))
+    return pooled.cpu().numpy().astype(np.float32), weights
+
+
+class EmbeddingBatcher:
+    """Single inference worker that embeds pending queries together.
+
+    Request threads submit a query text and block on a Future. The worker takes
+    the first pending text, collects whatever else arrives within `max_wait`
+    seconds (up to `max_batch` texts), runs one forward pass for all of them and
+    hands each vector back to its caller.
+    """
+
+    def __init__(self, max_batch: int = 32, max_wait: float = 0.005):
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait)
+        self.pending: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self.batches = 0
+        self.texts = 0
+        self.thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self.thread.start()
+
+    def embed(self, text: str) -> Tuple[np.ndarray, Weights | None]:
+        fut: Future = Future()
+        self.pending.put((text, fut))
+        return fut.result()
+
+    def _collect(self) -> List[Tuple[str, Future]]:
+        batch = [self.pending.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self.pending.get(timeout=remaining))
+                else:
+                    batch.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            try:
+                vecs, weights = encode_texts([text for text, _ in batch], sparse=SPARSE is not None)
+            except Exception as exc:
+                for _, fut in batch:
+                    fut.set_exception(exc)
+                continue
+            self.batches += 1
+            self.texts += len(batch)
+            for i, ((_, fut), vec) in enumerate(zip(batch, vecs)):
+                fut.set_result((vec, weights[i] if weights is not None else None))
+
+
+def _embed_query_uncached(query: str) -> Tuple[np.ndarray, Weights | None]:
+    if BATCHER is not None:
+        return BATCHER.embed(query)
+    vecs, weights = encode_texts([query], sparse=SPARSE is not None)
+    return vecs[0], weights[0] if weights is not None else None
+
+
+def embed_query_weights(query: str) -> Tuple[np.ndarray, Weights | None]:
+    """Query vector and lexical weights (None without a sparse index), cached together."""
+    value = QUERY_CACHE.get_or_compute(MODEL_ID, query, _embed_query_uncached)
+    if CACHE_LOG_EVERY:
+        lookups = QUERY_CACHE.hits + QUERY_CACHE.misses
+        if lookups % CACHE_LOG_EVERY == 0:
+            print(QUERY_CACHE.format_stats(), flush=True)
+    return value
+
+
+def warmup_texts() -> List[Tuple[str, List[str]]]:
+    """Representative inputs: a short query, a batch of queries, a paragraph-sized text."""
+    titles = [d.get("title") or "" for d in DOCS.values() if d.get("title")]
+    snippets = [d.get("snippet") or "" for d in DOCS.values() if d.get("snippet")]
+    query = " ".join((titles[0] if titles else "Theotokos Nestorius").split()[:4])
+    batch = [" ".join(t.split()[:4]) for t in titles[:32]] or [query]
+    if BATCHER is not None:
+        batch = (batch * BATCHER.max_batch)[: BATCHER.max_batch]
+    paragraph = snippets[0] if snippets else query
+    return [("query", [query]), ("query_batch", batch), ("paragraph", [paragraph])]
+
+
+def preload_model(rounds: int = 2) -> None:
+    """Load the model, then run warm-up batches so the first user never hits a cold model."""
+    try:
+        load_model()
+        MODEL_STATUS["state"] = "warming"
+        t0 = time.perf_counter()
+        timings = []
+        for name, texts in warmup_texts():
+            for i in range(max(1, rounds)):
+                t1 = time.perf_counter()
+                embed_texts(texts)
+                ms = round((time.perf_counter() - t1) * 1000, 1)
+                timings.append({"batch": name, "size": len(texts), "round": i, "ms": ms})
+        MODEL_STATUS.update(warmup_s=round(time.perf_counter() - t0, 3), warmup_batches=timings, state="ready")
+    except Exception as exc:
+        MODEL_STATUS.update(state="error", error=f"{type(exc).__name__}: {exc}")
+    print(f"Model {MODEL_STATUS['state']} (load {MODEL_STATUS['load_s']} s, warm-up {MODEL_STATUS['warmup_s']} s)", flush=True)
+
+
+def is_ready() -> bool:
+    if MODEL_STATUS["state"] == "error":
+        return False
+    # without --preload the model loads on first query, so the instance is always servable
+    return MODEL_STATUS["state"] == "ready" or not PRELOAD
+
+
+def best_paragraph(doc_id: str, qvec: np.ndarray) -> str | None:
+    paras = CORPUS.paragraphs(doc_id)
     if not paras:
         return None
 
+    span = PARA_RANGES.get(doc_id)
+    if span is not None and span[1] == len(paras):
+        start, count = span
+        scores = PARA_MATRIX[start : start + count] @ qvec
+        return paras[int(np.argmax(scores))]
+
+    # no (or stale) paragraph index for this doc: embed paragraphs live
     best = None
     best_score = -1.0
     batch_size = 16
     for i in range(0, len(paras), batch_size):
         batch = paras[i : i + batch_size]
-        vecs = embed_texts(batch)
-        for text, vec in zip(batch, vecs):
-            score = dot(qvec, vec)
-            if score > best_score:
-                best_score = score
-                best = text
+        scores = embed_texts(batch) @ qvec
+        best_idx = int(np.argmax(scores))
+        if scores[best_idx] > best_score:
+            best_score = float(scores[best_idx])
+            best = batch[best_idx]
     return best
 
 
-def search(query: str, top: int) -> List[Dict]:
-    qvec = embed_texts([query])[0]
-    scored = []
-    for row in DOC_EMB:
-        doc_id = row.get("doc_id")
-        vec = row.get("vector") or []
-        if not vec:
-            continue
-        scored.append((doc_id, dot(qvec, vec)))
-    scored.sort(key=lambda x: x[1], reverse=True)
-    top_results = scored[:top]
-
-    results = []
-    for doc_id, score in top_results:
+def rank_docs(qvec: np.ndarray, top: int) -> List[Tuple[int, float]]:
+    """(DOC_MATRIX row, score) of the best docs; approximate if an ANN probe is set."""
+    if DOC_MATRIX.shape[0] == 0:
+        return []
+    if ANN_PROBE and DOC_ANN is not None:
+        rows, scores = DOC_ANN.search(DOC_MATRIX, qvec, top, ANN_PROBE)
+        return [(int(i), float(s)) for i, s in zip(rows, scores)]
+    scores = DOC_MATRIX @ qvec
+    return [(int(i), float(scores[i])) for i in top_k(scores, top)]
+
+
+def rank_dense_sparse(qvec: np.ndarray, weights: Weights, top: int) -> List[Tuple[str, float]]:
+    """Exact dense score of every doc plus SPARSE_WEIGHT x its lexical score."""
+    scores = DOC_MATRIX @ qvec + SPARSE_WEIGHT * SPARSE.scores(weights)
+    return [(DOC_IDS[i], float(scores[i])) for i in top_k(scores, top)]
+
+
+def search_hits(query: str, top: int, mode: str = "dense") -> Tuple[np.ndarray | None, List[Dict]]:
+    """Ranked doc hits (id, score, title) without snippets, plus the query vector (None for bm25)."""
+    qvec = None
+    if mode != "bm25":
+        with stage("embed"):
+            qvec, weights = embed_query_weights(query)
+    with stage("score"):
+        if mode == "dense":
+            ranked = [(DOC_IDS[i], score) for i, score in rank_docs(qvec, top)]
+        elif mode == "chunks":
+            ranked = CHUNKS.search(qvec, top, CHUNK_TOP_M)
+        elif mode == "sparse":
+            ranked = SPARSE.search(weights or {}, top)
+        elif mode == "dense+sparse":
+            ranked = rank_dense_sparse(qvec, weights or {}, top)
+        else:
+            lexical = BM25.search(query_terms(query), top if mode == "bm25" else RRF_DEPTH)
+            if mode == "bm25":
+                ranked = lexical
+            else:
+                dense = [(DOC_IDS[i], score) for i, score in rank_docs(qvec, RRF_DEPTH)]
+                ranked = rrf([dense, lexical], top)
+    hits = []
+    for doc_id, score in ranked:
         meta = DOCS.get(doc_id, {})
-        snippet = best_paragraph(doc_id, qvec) or meta.get("snippet") or ""
-        results.append(
-            {
-                "doc_id": doc_id,
-                "score": score,
-                "title": meta.get("title") or doc_id,
-                "snippet": snippet,
-            }
-        )
-    return results
+        hits.append({"doc_id": doc_id, "score": score, "title": meta.get("title") or doc_id})
+    return qvec, hits
+
+
+def snippet_for(doc_id: str, qvec: np.ndarray | None, query: str) -> str:
+    with stage("snippet"):
+        if qvec is None:
+            para = best_paragraph_lexical(CORPUS.paragraphs(doc_id), query_terms(query))
+        else:
+            para = best_paragraph(doc_id, qvec)
+        return para or DOCS.get(doc_id, {}).get("snippet") or ""
+
+
+def search(query: str, top: int, mode: str = "dense") -> List[Dict]:
+    qvec, hits = search_hits(query, top, mode)
+    for hit in hits:
+        hit["snippet"] = snippet_for(hit["doc_id"], qvec, query)
+    return hits
 
 
 class Handler(SimpleHTTPRequestHandler):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, directory=BASE_DIR, **kwargs)
 
+    def send_json(self, status: int, payload: Dict) -> None:
+        with stage("serialize"):
+            body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_event(self, payload: Dict) -> None:
+        with stage("serialize"):
+            body = json.dumps(payload).encode("utf-8") + b"\n"
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    def send_metrics(self) -> None:
+        cache = QUERY_CACHE.stats()
+        counters = {
+            "query_cache_hits": cache["hits"],
+            "query_cache_misses": cache["misses"],
+            "query_cache_evictions": cache["evictions"],
+        }
+        gauges = {
+            "query_cache_entries": cache["size"],
+            "model_ready": 1 if MODEL_STATUS["state"] == "ready" else 0,
+            "uptime_seconds": round(time.time() - STARTED_AT, 1),
+        }
+        if BATCHER is not None:
+            counters["batcher_batches"] = BATCHER.batches
+            counters["batcher_texts"] = BATCHER.texts
+        body = METRICS.render_prometheus(gauges=gauges, counters=counters).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_search(self, query: str, top: int, stream: bool, mode: str = "dense") -> None:
+        _REQUEST.timings = {}
+        METRICS.inc("search_requests")
+        METRICS.inc("search_requests_by_mode", labels={"mode": mode})
+        t0 = time.perf_counter()
+        try:
+            if stream:
+                self.stream_search(query, top, mode)
+            else:
+                self.send_json(200, {"results": search(query, top, mode)})
+        except Exception:
+            METRICS.inc("search_errors")
+            raise
+        finally:
+            total = time.perf_counter() - t0
+            METRICS.observe("total", total)
+            timings = _REQUEST.timings
+            _REQUEST.timings = None
+            if LOG_STAGES:
+                parts = " ".join(f"{k}={v * 1000:.1f}ms" for k, v in timings.items())
+                print(
+                    f"search q={query!r} top={top} mode={mode} stream={int(stream)} "
+                    f"total={total * 1000:.1f}ms {parts}",
+                    flush=True,
+                )
+
+    def stream_search(self, query: str, top: int, mode: str = "dense") -> None:
+        """NDJSON: ranked hits first, then one snippet event per hit, then done."""
+        qvec, hits = search_hits(query, top, mode)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.send_event({"event": "results", "results": hits})
+        for hit in hits:
+            snippet = snippet_for(hit["doc_id"], qvec, query)
+            self.send_event({"event": "snippet", "doc_id": hit["doc_id"], "snippet": snippet})
+        self.send_event({"event": "done"})
+
     def do_GET(self):
         parsed = urlparse(self.path)
         if parsed.path == "/api/search":
             qs = parse_qs(parsed.query)
             q = (qs.get("q") or [""])[0].strip()
             top = int((qs.get("top") or ["10"])[0])
+            stream = (qs.get("stream") or ["0"])[0] in ("1", "true")
+            mode = (qs.get("mode") or ["dense"])[0]
             if not q:
-                self.send_response(400)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps({"error": "missing query"}).encode("utf-8"))
+                self.send_json(400, {"error": "missing query"})
+                return
+            if mode not in SEARCH_MODES:
+                self.send_json(400, {"error": f"unknown mode '{mode}' (expected {', '.join(SEARCH_MODES)})"})
+                return
+            if mode == "chunks" and CHUNKS is None:
+                self.send_json(400, {"error": f"no chunk vectors in {EMB_DIR}; rebuild with build_search_index_bge_m3.py"})
+                return
+            if mode in ("sparse", "dense+sparse") and SPARSE is None:
+                self.send_json(400, {"error": f"no sparse index in {EMB_DIR}; rebuild with build_search_index_bge_m3.py"})
                 return
-            results = search(q, top)
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps({"results": results}).encode("utf-8"))
+            if mode in ("bm25", "hybrid") and BM25 is None:
+                self.send_json(400, {"error": f"no BM25 index in {BM25_DIR}; run build_search_index.py"})
+                return
+            self.handle_search(q, top, stream, mode)
+            return
+        if parsed.path == "/api/metrics":
+            self.send_metrics()
+            return
+        if parsed.path == "/api/cache":
+            self.send_json(200, {"query_cache": QUERY_CACHE.stats()})
+            return
+        if parsed.path == "/healthz":
+            self.send_json(
+                200,
+                {
+                    "status": "ok",
+                    "uptime_s": round(time.time() - STARTED_AT, 1),
+                    "preload": PRELOAD,
+                    "model": MODEL_STATUS,
+                },
+            )
+            return
+        if parsed.path == "/readyz":
+            ready = is_ready()
+            self.send_json(200 if ready else 503, {"ready": ready, "state": MODEL_STATUS["state"]})
             return
         return super().do_GET()
 
 
-if __name__ == "__main__":
-    server = HTTPServer(("", 8000), Handler)
-    print("Server running on http://localhost:8000")
+class ConcurrentHTTPServer(ThreadingHTTPServer):
+    # default backlog of 5 drops connections under bursts of concurrent clients
+    request_queue_size = 128
+
+
+def main() -> None:
+    global BATCHER, QUERY_CACHE, CACHE_LOG_EVERY, PRELOAD, QUANTIZE, MODEL_ID, ANN_PROBE, LOG_STAGES, CHUNK_TOP_M
+    global SPARSE_WEIGHT
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="threaded server; query embeddings are micro-batched by one inference worker",
+    )
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--batch-wait-ms", type=float, default=5.0)
+    parser.add_argument("--cache-size", type=int, default=1024, help="query embedding LRU entries (0 disables)")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="seconds before a cached query vector expires")
+    parser.add_argument("--cache-log-every", type=int, default=0, help="log cache stats every N lookups")
+    parser.add_argument("--preload", action="store_true", help="load and warm up the model in the background at startup")
+    parser.add_argument("--warmup-rounds", type=int, default=2)
+    parser.add_argument(
+        "--quantize",
+        choices=QUANTIZATION_MODES,
+        default="none",
+        help="reduced-precision CPU inference; should match the mode the index was built with",
+    )
+    parser.add_argument(
+        "--ann-probe",
+        type=int,
+        default=0,
+        help="score only the N closest IVF lists of doc_ann_ivf.npz (0 = exact search)",
+    )
+    parser.add_argument(
+        "--chunk-top-m",
+        type=int,
+        default=1,
+        help="mode=chunks: average each doc's N best chunk similarities (1 = best chunk only)",
+    )
+    parser.add_argument(
+        "--sparse-weight",
+        type=float,
+        default=SPARSE_WEIGHT,
+        help="mode=dense+sparse: weight of the lexical score added to the dense score",
+    )
+    parser.add_argument("--log-stages", action="store_true", help="log a per-request stage breakdown")
+    args = parser.parse_args()
+
+    LOG_STAGES = args.log_stages
+
+    ANN_PROBE = max(0, args.ann_probe)
+    if ANN_PROBE and DOC_ANN is None:
+        print("No doc ANN index found; using exact search")
+    CHUNK_TOP_M = max(1, args.chunk_top_m)
+    SPARSE_WEIGHT = args.sparse_weight
+
+    QUANTIZE = args.quantize
+    MODEL_ID = f"{resolve_model_path(MODEL_DIR)}#{QUANTIZE}"
+
+    QUERY_CACHE = EmbeddingCache(max_size=args.cache_size, ttl=args.cache_ttl)
+    CACHE_LOG_EVERY = max(0, args.cache_log_every)
+
+    if args.concurrent:
+        BATCHER = EmbeddingBatcher(args.max_batch, args.batch_wait_ms / 1000.0)
+        server = ConcurrentHTTPServer(("", args.port), Handler)
+        mode = f"concurrent, max batch {BATCHER.max_batch}, wait {args.batch_wait_ms:g} ms"
+    else:
+        server = HTTPServer(("", args.port), Handler)
+        mode = "single-threaded"
+    if args.preload:
+        PRELOAD = True
+        MODEL_STATUS["state"] = "loading"
+        threading.Thread(target=preload_model, args=(args.warmup_rounds,), name="model-preload", daemon=True).start()
+    if QUANTIZE != "none":
+        mode += f", {QUANTIZE} inference"
+    print(f"Server running on http://localhost:{args.port} ({mode})", flush=True)
     server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()